@@ -30,6 +30,48 @@ export interface PerformanceDistributionData {
   needs_improvement: number;
 }
 
+export interface DashboardStats {
+  days: string;
+  generated_at: string;
+  summary: SummaryStats;
+  user_growth: UserGrowthData;
+  subject_performance: SubjectPerformanceData;
+  quiz_activity: QuizActivityData;
+  performance_distribution: PerformanceDistributionData;
+}
+
+export async function fetchDashboardStats(days?: number): Promise<DashboardStats> {
+  try {
+    const url = `${process.env.NEXT_PUBLIC_BASE_URL}/api/admin/stats/dashboard?days=${days ?? 'all'}`;
+    const response = await fetch(url, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      cache: 'no-store',
+    });
+
+    if (!response.ok) {
+      throw new Error(`Failed to fetch dashboard stats: ${response.statusText}`);
+    }
+
+    const data = await response.json();
+    const distribution = data.performance_distribution;
+    return {
+      ...data,
+      performance_distribution: {
+        excellent: distribution[0] || 0,
+        good: distribution[1] || 0,
+        average: distribution[2] || 0,
+        needs_improvement: distribution[3] || 0
+      }
+    };
+  } catch (error) {
+    console.error('Error fetching dashboard stats:', error);
+    throw new Error('Failed to fetch dashboard stats');
+  }
+}
+
 export async function fetchSummaryStats(days?: number): Promise<SummaryStats> {
   try {
     const url = `${process.env.NEXT_PUBLIC_BASE_URL}/api/admin/stats/summary${days ? `?days=${days}` : ''}`;
@@ -20,11 +20,7 @@ import {
   Area
 } from 'recharts';
 import {
-  fetchSummaryStats,
-  fetchUserGrowth,
-  fetchSubjectPerformance,
-  fetchQuizActivity,
-  fetchPerformanceDistribution,
+  fetchDashboardStats,
   SummaryStats,
   UserGrowthData,
   SubjectPerformanceData,
@@ -51,26 +47,14 @@ export default function AdminAnalytics() {
       // Convert timeFilter to number or undefined for "all"
       const daysParam = timeFilter === 'all' ? undefined : parseInt(timeFilter);
       
-      // Fetch all analytics data in parallel
-      const [
-        summaryData,
-        userGrowthData,
-        subjectPerformanceData,
-        quizActivityData,
-        performanceDistributionData
-      ] = await Promise.all([
-        fetchSummaryStats(daysParam),
-        fetchUserGrowth(daysParam),
-        fetchSubjectPerformance(),
-        fetchQuizActivity(daysParam),
-        fetchPerformanceDistribution()
-      ]);
-
-      setSummaryStats(summaryData);
-      setUserGrowth(userGrowthData);
-      setSubjectPerformance(subjectPerformanceData);
-      setQuizActivity(quizActivityData);
-      setPerformanceDistribution(performanceDistributionData);
+      // All five sections come from one dashboard snapshot
+      const dashboard = await fetchDashboardStats(daysParam);
+
+      setSummaryStats(dashboard.summary);
+      setUserGrowth(dashboard.user_growth);
+      setSubjectPerformance(dashboard.subject_performance);
+      setQuizActivity(dashboard.quiz_activity);
+      setPerformanceDistribution(dashboard.performance_distribution);
       setError(null);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to load analytics data');
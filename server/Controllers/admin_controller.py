@@ -1,14 +1,31 @@
-from flask import jsonify, request
+from flask import jsonify, request, Response, current_app
 from flask_restful import Resource
-from models import QuizAttempt, db, User, Subject, Chapter, Quiz, Question, Score
-from functools import wraps
-from datetime import datetime, timedelta
+from models import QuizAttempt, db, User, Subject, Chapter, Quiz, Question, Score, Role
+from datetime import date, datetime
 import pytz
 from sqlalchemy.orm import joinedload
-from sqlalchemy import func, or_
-# from extensions import cache
+from sqlalchemy import or_
+from quiz_cache import invalidate_quiz, invalidate_quizzes
+from catalog_cache import bump_tags, cache_stats
+from stats_cache import memoize_stats
+from attempt_state import forget_attempt_state, forget_quiz_states
+from grading import parse_edges, DISTRIBUTION_EDGES
+from timeseries import forget_time_series
+from export_jobs import bump_data_version
+from admin_stats import period_start, summary_stats, user_growth, subject_performance, quiz_activity, performance_distribution, quiz_histogram, get_dashboard_snapshot, QUIZ_HISTOGRAM_EDGES, DASHBOARD_PERIODS
 
 # Helper functions
+def refresh_quiz_stats(quiz_ids, regrade=False):
+    """Regrade (if asked) and rebuild the daily stats of the given quizzes in a Celery worker"""
+    quiz_ids = sorted(set(quiz_ids))
+    if not quiz_ids:
+        return
+    try:
+        current_app.extensions['celery'].send_task('celery_worker.refresh_quiz_stats', args=[quiz_ids, regrade])
+    except Exception as e:
+        # The nightly rollup rebuild picks the change up
+        print(f"Failed to schedule stats refresh for quizzes {quiz_ids}: {str(e)}")
+
 def convert_to_ist1(dt):
     if not dt:
         return None
@@ -18,31 +35,6 @@ def convert_to_ist1(dt):
         dt = pytz.utc.localize(dt)
     return dt.astimezone(IST)
 
-def convert_to_ist2(dt):
-    if not dt:
-        return None
-        
-    IST = pytz.timezone("Asia/Kolkata")
-    
-    # Handle string inputs
-    if isinstance(dt, str):
-        try:
-            # Parse date strings
-            dt = datetime.strptime(dt, '%Y-%m-%d').date()
-            return dt.isoformat()  # Return as-is for date-only strings
-        except:
-            # Try parsing datetime strings
-            try:
-                naive_dt = datetime.fromisoformat(dt)
-                return naive_dt.astimezone(IST).isoformat()
-            except:
-                return dt  # Fallback to original string
-    
-    # Handle datetime objects
-    if dt.tzinfo is None:
-        dt = pytz.utc.localize(dt)
-    return dt.astimezone(IST).isoformat()
-
 def parse_ist_datetime(dt_str):
     if not dt_str:
         return None        
@@ -82,11 +74,16 @@ def register_admin_routes(api):
             user = User.query.get(id)
             if not user:
                 return {'message': 'User not found'}, 404
+            attempted_quiz_ids = [quiz_id for (quiz_id,) in db.session.query(QuizAttempt.quiz_id).filter_by(user_id=id)]
             QuizAttempt.query.filter_by(user_id=id).delete()
             Score.query.filter_by(user_id=id).delete()
 
             db.session.delete(user)
             db.session.commit()
+            forget_attempt_state(id)
+            refresh_quiz_stats(attempted_quiz_ids)
+            forget_time_series('user-growth')
+            bump_data_version()
             return {'message': 'User deleted successfully'}
         
     class AdminSubjects(Resource):
@@ -99,8 +96,7 @@ def register_admin_routes(api):
             new_subject = Subject(name=name, description=description)
             db.session.add(new_subject)
             db.session.commit()
-            # cache.delete_memoized("user_subjects")
-            # cache.delete("user_subjects")
+            bump_tags('subjects', 'search')
             return {
                 'id': new_subject.id,
                 'name': new_subject.name,
@@ -121,7 +117,11 @@ def register_admin_routes(api):
             subject.name = name
             subject.description = description
             db.session.commit()
-            # cache.delete("user_subjects")
+            # Quiz payloads and chapter pages embed the subject name
+            invalidate_quizzes(quiz_id for (quiz_id,) in db.session.query(Quiz.id)
+                               .join(Chapter).filter(Chapter.subject_id == id))
+            bump_tags('subjects', f"subject:{id}", 'search',
+                      *[f"chapter:{chapter.id}" for chapter in subject.chapters])
             return {'message': 'Subject updated'}
 
         # @admin_required
@@ -130,14 +130,20 @@ def register_admin_routes(api):
             if not subject:
                 return {'message': 'Subject not found'}, 404
             
+            chapter_tags = [f"chapter:{chapter.id}" for chapter in subject.chapters]
+            quiz_ids = [quiz_id for (quiz_id,) in db.session.query(Quiz.id)
+                        .join(Chapter).filter(Chapter.subject_id == id)]
+            
             try:
                 # The cascade should automatically delete chapters, quizzes, questions, etc.
                 db.session.delete(subject)
                 db.session.commit()
                 
                 # Clear relevant caches
-                # cache.delete("user_subjects")
-                # cache.delete_memoized("user_subjects")
+                invalidate_quizzes(quiz_ids)
+                bump_tags('subjects', f"subject:{id}", 'chapters', 'search', *chapter_tags)
+                forget_time_series('quiz-activity')
+                bump_data_version()
                 
                 return {'message': 'Subject and all associated data deleted successfully'}, 200
             except Exception as e:
@@ -159,7 +165,7 @@ def register_admin_routes(api):
             )
             db.session.add(new_chapter)
             db.session.commit()
-            # cache.delete(f"subject_{subject_id}")
+            bump_tags(f"subject:{subject_id}", 'chapters', 'search')
             return {
                 'id': new_chapter.id,
                 'name': new_chapter.name,
@@ -181,7 +187,9 @@ def register_admin_routes(api):
             chapter.name = name
             chapter.description = description
             db.session.commit()
-            # cache.delete(f"subject_{chapter.subject_id}")
+            # Quiz payloads embed the chapter name
+            invalidate_quizzes(quiz.id for quiz in chapter.quizzes)
+            bump_tags(f"subject:{chapter.subject_id}", f"chapter:{id}", 'search')
             return {'message': 'Chapter updated'}
 
         def delete(self, id):
@@ -190,6 +198,7 @@ def register_admin_routes(api):
                 return {'message': 'Chapter not found'}, 404
             
             subject_id = chapter.subject_id
+            quiz_ids = [quiz.id for quiz in chapter.quizzes]
             
             try:
                 # Cascade should automatically delete quizzes, questions, etc.
@@ -197,7 +206,10 @@ def register_admin_routes(api):
                 db.session.commit()
                 
                 # Clear relevant caches
-                # cache.delete(f"subject_{subject_id}")
+                invalidate_quizzes(quiz_ids)
+                bump_tags(f"subject:{subject_id}", f"chapter:{id}", 'chapters', 'search')
+                forget_time_series('quiz-activity')
+                bump_data_version()
                 
                 return {'message': 'Chapter and all associated quizzes deleted successfully'}, 200
             except Exception as e:
@@ -236,7 +248,7 @@ def register_admin_routes(api):
             )
             db.session.add(new_quiz)
             db.session.commit()
-            # cache.delete(f"chapter_{chapter_id}")
+            bump_tags(f"chapter:{chapter_id}", 'search')
             return format_response(new_quiz), 201
 
     class AdminQuiz(Resource):
@@ -247,6 +259,7 @@ def register_admin_routes(api):
                 return {'error': 'Quiz not found'}, 404
 
             data = request.get_json()
+            previous_chapter_id = quiz.chapter_id
             chapter_id = data.get('chapter_id')
             start_str = data.get('start_time')
             end_str = data.get('end_time')
@@ -280,7 +293,12 @@ def register_admin_routes(api):
                 quiz.remarks = remarks
 
             db.session.commit()
-            # cache.delete(f"chapter_{chapter_id}")
+            invalidate_quiz(quiz.id)
+            bump_tags(f"chapter:{previous_chapter_id}", f"chapter:{quiz.chapter_id}", 'search')
+            if quiz.chapter_id != previous_chapter_id:
+                # Cached attempt states and daily stats rows carry the quiz's chapter
+                forget_quiz_states(quiz.id)
+                refresh_quiz_stats([quiz.id])
             return jsonify(format_response(quiz))
 
         def delete(self, id):
@@ -294,9 +312,12 @@ def register_admin_routes(api):
                 # Cascade should automatically delete questions, scores, attempts
                 db.session.delete(quiz)
                 db.session.commit()
+                invalidate_quiz(id)
                 
                 # Clear relevant caches
-                # cache.delete(f"chapter_{chapter_id}")
+                bump_tags(f"chapter:{chapter_id}", 'search')
+                forget_time_series('quiz-activity')
+                bump_data_version()
                 
                 return {'message': 'Quiz and all associated questions deleted successfully'}, 200
             except Exception as e:
@@ -322,6 +343,7 @@ def register_admin_routes(api):
             )
             db.session.add(new_question)
             db.session.commit()
+            invalidate_quiz(quiz_id)
             return {
                 'id': new_question.id,
                 'quiz_id': new_question.quiz_id,
@@ -368,6 +390,11 @@ def register_admin_routes(api):
                     setattr(question, field, data[field])
             
             db.session.commit()
+            invalidate_quiz(question.quiz_id)
+            if 'correct_option' in data:
+                # Score exports carry the correct option; attempt exports follow the regrade
+                bump_data_version(['scores'])
+                refresh_quiz_stats([question.quiz_id], regrade=True)
             return {
                 'id': question.id,
                 'quiz_id': question.quiz_id,
@@ -386,8 +413,12 @@ def register_admin_routes(api):
             question = Question.query.get(id)
             if not question:
                 return {'error': 'Question not found'}, 404
+            quiz_id = question.quiz_id
             db.session.delete(question)
             db.session.commit()
+            invalidate_quiz(quiz_id)
+            bump_data_version()
+            refresh_quiz_stats([quiz_id], regrade=True)
             return {'message': 'Question deleted successfully'}, 200
 
     class AdminSearch(Resource):
@@ -527,212 +558,111 @@ def register_admin_routes(api):
 
     class AdminSummaryStats(Resource):
         # @admin_required
+        @memoize_stats('summary')
         def get(self):
             # Get query parameters
             days = request.args.get('days', '30')
             subject_id = request.args.get('subject', 'all')
             user_type = request.args.get('userType', 'all')
-            
-            # Calculate date range
-            if days == 'all':
-                start_date = None
+
+            # userType is a user role ('user' or 'admin')
+            role = None
+            if user_type != 'all':
+                try:
+                    role = Role(user_type)
+                except ValueError:
+                    return {'error': f'Invalid userType: {user_type}'}, 400
+
+            if subject_id == 'all':
+                subject_id = None
             else:
-                start_date = datetime.utcnow() - timedelta(days=int(days))
-            
-            # Total users
-            total_users = User.query.count()
-            
-            # Active users (logged in within the time range)
-            active_users = User.query
-            if start_date:
-                active_users = active_users.filter(User.last_visited >= start_date)
-            active_users_count = active_users.count()
-            
-            # Quizzes taken
-            quizzes_taken = QuizAttempt.query
-            if start_date:
-                quizzes_taken = quizzes_taken.filter(QuizAttempt.end_time >= start_date)
-            quizzes_taken_count = quizzes_taken.count()
-            
-            # Average score
-            avg_score = 0
-            if quizzes_taken_count > 0:
-                # Calculate average score across all attempts
-                total_correct = 0
-                total_questions = 0
-                
-                for attempt in quizzes_taken:
-                    scores = Score.query.filter_by(attempt_id=attempt.id).all()
-                    correct_in_attempt = sum(
-                        1 for score in scores
-                        if score.selected_option == score.question.correct_option
-                    )
-                    total_correct += correct_in_attempt
-                    total_questions += len(scores)
-                
-                if total_questions > 0:
-                    avg_score = round((total_correct / total_questions) * 100, 1)
-            
-            return {
-                'totalUsers': total_users,
-                'activeUsers': active_users_count,
-                'quizzesTaken': quizzes_taken_count,
-                'avgScore': avg_score
-            }, 200
+                try:
+                    subject_id = int(subject_id)
+                except ValueError:
+                    return {'error': f'Invalid subject: {subject_id}'}, 400
+
+            try:
+                start_date = period_start(days)
+            except ValueError:
+                return {'error': f'Invalid days: {days}'}, 400
+
+            return summary_stats(start_date, subject_id, role), 200
 
     class AdminUserGrowth(Resource):
         # @admin_required
+        @memoize_stats('user-growth')
         def get(self):
             days = request.args.get('days', '30')
-            
-            # Calculate date range
-            if days == 'all':
-                start_date = None
-            else:
-                start_date = datetime.utcnow() - timedelta(days=int(days))
-            
-            # Group users by creation date
-            query = db.session.query(
-                func.date(User.created_at).label('date'),
-                func.count(User.id).label('count')
-            )
-            
-            if start_date:
-                query = query.filter(User.created_at >= start_date)
-            
-            results = query.group_by(func.date(User.created_at)).all()
-            
-            # Format results
-            labels = [convert_to_ist2(result[0]) for result in results]
-            values = [result[1] for result in results]
-            
-            return {
-                'labels': labels,
-                'values': values
-            }, 200
+            granularity = request.args.get('granularity', 'day')
+            try:
+                return user_growth(period_start(days), granularity), 200
+            except ValueError as e:
+                return {'error': str(e)}, 400
 
     class AdminSubjectPerformance(Resource):
         # @admin_required
+        @memoize_stats('subject-performance')
         def get(self):
-            # Get average score per subject
-            subjects = Subject.query.all()
-            subject_data = []
-            
-            for subject in subjects:
-                # Get all quizzes in this subject
-                quizzes = Quiz.query.join(Chapter).filter(Chapter.subject_id == subject.id).all()
-                quiz_ids = [quiz.id for quiz in quizzes]
-                
-                # Get all attempts for these quizzes
-                attempts = QuizAttempt.query.filter(QuizAttempt.quiz_id.in_(quiz_ids)).all()
-                
-                total_correct = 0
-                total_questions = 0
-                
-                for attempt in attempts:
-                    scores = Score.query.filter_by(attempt_id=attempt.id).all()
-                    correct_in_attempt = sum(
-                        1 for score in scores
-                        if score.selected_option == score.question.correct_option
-                    )
-                    total_correct += correct_in_attempt
-                    total_questions += len(scores)
-                
-                avg_score = 0
-                if total_questions > 0:
-                    avg_score = round((total_correct / total_questions) * 100, 1)
-                
-                subject_data.append({
-                    'subject': subject.name,
-                    'avg_score': avg_score
-                })
-            
-            # Sort by average score descending
-            subject_data.sort(key=lambda x: x['avg_score'], reverse=True)
-            
-            return {
-                'labels': [s['subject'] for s in subject_data],
-                'values': [s['avg_score'] for s in subject_data]
-            }, 200
+            return subject_performance(), 200
 
     class AdminQuizActivity(Resource):
         # @admin_required
+        @memoize_stats('quiz-activity')
         def get(self):
             days = request.args.get('days', '30')
-            
-            # Calculate date range
-            if days == 'all':
-                start_date = None
-            else:
-                start_date = datetime.utcnow() - timedelta(days=int(days))
-            
-            # Group quiz attempts by date
-            query = db.session.query(
-                func.date(QuizAttempt.end_time).label('date'),
-                func.count(QuizAttempt.id).label('count')
-            ).filter(QuizAttempt.end_time.isnot(None))
-            
-            if start_date:
-                query = query.filter(QuizAttempt.end_time >= start_date)
-            
-            results = query.group_by(func.date(QuizAttempt.end_time)).all()
-            
-            # Format results
-            labels = [convert_to_ist2(result[0]) for result in results]
-            values = [result[1] for result in results]
-            
-            return {
-                'labels': labels,
-                'values': values
-            }, 200
+            granularity = request.args.get('granularity', 'day')
+            try:
+                return quiz_activity(period_start(days), granularity), 200
+            except ValueError as e:
+                return {'error': str(e)}, 400
 
     class AdminPerformanceDistribution(Resource):
         # @admin_required
+        @memoize_stats('performance-distribution')
         def get(self):
-            # Get all completed quiz attempts
-            attempts = QuizAttempt.query.filter(QuizAttempt.end_time.isnot(None)).all()
-            
-            # Initialize buckets
-            buckets = {
-                'excellent': 0,    # 90-100%
-                'good': 0,         # 75-89%
-                'average': 0,      # 60-74%
-                'needs_improvement': 0  # <60%
-            }
-            
-            for attempt in attempts:
-                # Calculate score percentage
-                scores = Score.query.filter_by(attempt_id=attempt.id).all()
-                total_questions = len(scores)
-                
-                if total_questions == 0:
-                    continue
-                    
-                correct_answers = sum(
-                    1 for score in scores
-                    if score.selected_option == score.question.correct_option
-                )
-                score_percentage = (correct_answers / total_questions) * 100
-                
-                # Categorize into buckets
-                if score_percentage >= 90:
-                    buckets['excellent'] += 1
-                elif score_percentage >= 75:
-                    buckets['good'] += 1
-                elif score_percentage >= 60:
-                    buckets['average'] += 1
-                else:
-                    buckets['needs_improvement'] += 1
-            
-            return [
-                buckets['excellent'],
-                buckets['good'],
-                buckets['average'],
-                buckets['needs_improvement']
-            ], 200
-        
+            try:
+                edges = parse_edges(request.args['edges']) if 'edges' in request.args else DISTRIBUTION_EDGES
+                subject_id = int(request.args['subject']) if 'subject' in request.args else None
+                quiz_id = int(request.args['quiz']) if 'quiz' in request.args else None
+                from_day = date.fromisoformat(request.args['from']) if 'from' in request.args else None
+                to_day = date.fromisoformat(request.args['to']) if 'to' in request.args else None
+            except ValueError as e:
+                return {'error': f'Invalid parameter: {str(e)}'}, 400
+
+            return performance_distribution(edges, subject_id, quiz_id, from_day, to_day), 200
+
+    class AdminQuizHistogram(Resource):
+        # @admin_required
+        @memoize_stats('quiz-histogram')
+        def get(self, quiz_id):
+            if not Quiz.query.get(quiz_id):
+                return {'error': 'Quiz not found'}, 404
+            try:
+                edges = parse_edges(request.args['edges']) if 'edges' in request.args else QUIZ_HISTOGRAM_EDGES
+            except ValueError as e:
+                return {'error': f'Invalid edges: {str(e)}'}, 400
+            return quiz_histogram(quiz_id, edges), 200
+
+    class AdminDashboardStats(Resource):
+        # @admin_required
+        def get(self):
+            # Served as stored: beat keeps a snapshot per period up to date
+            days = request.args.get('days', '30')
+            if days not in DASHBOARD_PERIODS:
+                return {'error': f"days must be one of {', '.join(DASHBOARD_PERIODS)}"}, 400
+            return Response(get_dashboard_snapshot(days), mimetype='application/json')
+
+    class AdminCacheStats(Resource):
+        # @admin_required
+        def get(self):
+            # Counters are per worker process
+            return cache_stats(), 200
+
     api.add_resource(AdminSummaryStats, '/admin/stats/summary')
     api.add_resource(AdminUserGrowth, '/admin/stats/user-growth')
     api.add_resource(AdminSubjectPerformance, '/admin/stats/subject-performance')
     api.add_resource(AdminQuizActivity, '/admin/stats/quiz-activity')
-    api.add_resource(AdminPerformanceDistribution, '/admin/stats/performance-distribution')
\ No newline at end of file
+    api.add_resource(AdminPerformanceDistribution, '/admin/stats/performance-distribution')
+    api.add_resource(AdminQuizHistogram, '/admin/stats/quizzes/<int:quiz_id>/histogram')
+    api.add_resource(AdminDashboardStats, '/admin/stats/dashboard')
+    api.add_resource(AdminCacheStats, '/admin/stats/cache')
\ No newline at end of file
@@ -1,10 +1,45 @@
 from flask_restful import Resource
-from flask import request, jsonify
+from flask import request, jsonify, current_app, Response
 from datetime import datetime
-from models import db, Quiz, QuizAttempt, Score, Question, QuizAttempt, Score, Quiz, Chapter 
+import gzip
+from models import db, Quiz, QuizAttempt, Score, QuizAttempt, Score, Quiz, Chapter 
 import pytz
 # from extensions import cache
+from sqlalchemy import insert
 from sqlalchemy.orm import joinedload
+from quiz_cache import get_answer_key, get_quiz_meta
+from grading import attempt_results, question_counts, percentage, clean_answers
+from submissions import apply_submission, enqueue_submission, is_pending
+from result_snapshots import build_documents, store_snapshots, get_snapshot_header, get_snapshot_body
+from attempt_state import get_attempt_state, set_attempt_state, load_attempt_states, state_from_attempt, upsert_attempt
+from rollups import record_attempt_started, record_attempts_completed
+
+def attempt_status(state):
+    """Format a cached attempt state the way the attempt status endpoints return it"""
+    if state is None:
+        # Return a successful response with no attempt found
+        return {
+            'has_attempt': False,
+            'message': 'No attempt found'
+        }
+
+    # Check if the attempt is completed (has end_time)
+    if state['completed']:
+        status = {
+            'has_attempt': True,
+            'attempt_id': state['attempt_id'],
+            'completed': True,
+            'end_time': state['end_time']
+        }
+        if state.get('grading_pending'):
+            status['grading_pending'] = True
+        return status
+    return {
+        'has_attempt': True,
+        'attempt_id': state['attempt_id'],
+        'completed': False,
+        'start_time': state['start_time']
+    }
 
 class GetAttemptByQuiz(Resource):
     def post(self):
@@ -17,34 +52,25 @@ class GetAttemptByQuiz(Resource):
         if not quiz_id:
             return {'error': 'Quiz ID is required'}, 400
 
-        # Find the most recent attempt for this user and quiz
-        attempt = QuizAttempt.query.filter_by(
-            user_id=int(current_user_id),
-            quiz_id=quiz_id
-        ).order_by(QuizAttempt.start_time.desc()).first()
+        # Served from the user's attempt state hash; a miss loads it from the database
+        found, state = get_attempt_state(current_user_id, quiz_id)
+        if not found:
+            state = load_attempt_states(current_user_id).get(int(quiz_id))
 
-        if not attempt:
-            # Return a successful response with no attempt found
-            return {
-                'has_attempt': False,
-                'message': 'No attempt found'
-            }, 200
+        return attempt_status(state), 200
 
-        # Check if the attempt is completed (has end_time)
-        if attempt.end_time is not None:
-            return {
-                'has_attempt': True,
-                'attempt_id': attempt.id,
-                'completed': True,
-                'end_time': attempt.end_time.isoformat() + 'Z'
-            }, 200
-        else:
-            return {
-                'has_attempt': True,
-                'attempt_id': attempt.id,
-                'completed': False,
-                'start_time': attempt.start_time.isoformat() + 'Z'
-            }, 200
+def snapshot_response(etag, body):
+    """Serve a gzip snapshot body, or 304 when the client already holds this ETag"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(body, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(gzip.decompress(body), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    return response
 
 class QuizResults(Resource):
     def post(self, attempt_id):
@@ -54,6 +80,17 @@ class QuizResults(Resource):
         if not user_id:
             return {'error': 'User ID is required'}, 400
 
+        # A current snapshot answers without touching the database
+        header = get_snapshot_header(attempt_id)
+        if header:
+            if header['user_id'] != int(user_id):
+                return {'error': 'Unauthorized to view these results'}, 403
+            if request.if_none_match.contains(header['etag']):
+                return snapshot_response(header['etag'], None)
+            body = get_snapshot_body(attempt_id)
+            if body is not None:
+                return snapshot_response(header['etag'], body)
+
         # Fetch the quiz attempt
         attempt = QuizAttempt.query.get_or_404(attempt_id)
         
@@ -61,45 +98,21 @@ class QuizResults(Resource):
         if attempt.user_id != int(user_id):
             return {'error': 'Unauthorized to view these results'}, 403
 
-        # Fetch all scores for this attempt
-        scores = Score.query.filter_by(attempt_id=attempt_id).all()
-        
-        # Calculate results
-        results = []
-        correct_count = 0
-        
-        for score in scores:
-            question = Question.query.get(score.question_id)
-            is_correct = score.selected_option == question.correct_option
-            if is_correct:
-                correct_count += 1
-                
-            results.append({
-                'question_id': question.id,
-                'statement': question.question_statement,
-                'options': [
-                    question.option1,
-                    question.option2,
-                    question.option3,
-                    question.option4
-                ],
-                'correct_option': question.correct_option,
-                'selected_option': score.selected_option,
-                'is_correct': is_correct
-            })
-        
-        # Return quiz results
-        return {
-            'quiz_id': attempt.quiz_id,
-            'attempt_id': attempt.id,
-            'start_time': attempt.start_time.isoformat() + 'Z',
-            'end_time': attempt.end_time.isoformat() + 'Z' if attempt.end_time else None,
-            'time_spent': attempt.time_spent,
-            'total_questions': len(results),
-            'correct_answers': correct_count,
-            'score_percentage': round((correct_count / len(results)) * 100) if results else 0,
-            'questions': results
-        }
+        # A queued submission has not been written yet
+        if attempt.end_time is None and is_pending(attempt.id):
+            return {
+                'attempt_id': attempt.id,
+                'status': 'grading_pending',
+                'message': 'Grading pending'
+            }, 202
+
+        # Unfinished attempts have nothing worth snapshotting
+        if attempt.end_time is None:
+            return build_documents([attempt])[attempt.id]
+
+        # Missing or stale after a quiz edit: rebuild with one joined query
+        snapshot = store_snapshots([attempt])[attempt.id]
+        return snapshot_response(snapshot['etag'], snapshot['body'])
     
 class StartQuiz(Resource):
     def post(self, quiz_id):
@@ -109,45 +122,45 @@ class StartQuiz(Resource):
         if not user_id:
             return {'error': 'User ID is required'}, 400
 
-        quiz = Quiz.query.get_or_404(quiz_id)
+        quiz = get_quiz_meta(quiz_id)
+        if not quiz:
+            return {'error': 'Quiz not found'}, 404
         
         # Check if current time is within quiz availability window
         current_time = datetime.utcnow()
-        if current_time < quiz.start_time:
+        if current_time < quiz['start_time']:
             return {'error': 'Quiz has not started yet'}, 400
             
-        if current_time > quiz.end_time:
+        if current_time > quiz['end_time']:
             return {'error': 'Quiz has ended'}, 400
 
-        # Check if user has already completed this quiz
-        existing_attempt = QuizAttempt.query.filter_by(
-            user_id=user_id,
-            quiz_id=quiz_id
-        ).first()
+        # Repeated starts for the same user and quiz are answered from Redis
+        _, state = get_attempt_state(user_id, quiz_id)
+        status = 200
+        if state is None:
+            # Insert the attempt, or get the existing one back, in a single statement
+            attempt_id, start_time, end_time, created = upsert_attempt(int(user_id), quiz_id, current_time)
+            if created:
+                status = 201
+                try:
+                    # Counted in the attempt's transaction so a rollup rebuild sees both or neither
+                    with db.session.begin_nested():
+                        record_attempt_started(user_id, quiz, start_time)
+                except Exception as e:
+                    # The nightly rollup rebuild recounts it
+                    print(f"StartQuiz: Failed to update daily stats for quiz {quiz_id}: {str(e)}")
+            db.session.commit()
+            state = state_from_attempt(attempt_id, quiz_id, quiz['chapter_id'], start_time, end_time)
+            set_attempt_state(user_id, state)
         
-        if existing_attempt and existing_attempt.end_time is not None:
+        # Check if user has already completed this quiz
+        if state['completed']:
             return {'error': 'Quiz already attempted'}, 400
         
-        # If there's an existing attempt but not completed, return it
-        if existing_attempt:
-            return {
-                'attempt_id': existing_attempt.id,
-                'start_time': existing_attempt.start_time.isoformat() + 'Z'
-            }, 200
-
-        # Create new attempt
-        attempt = QuizAttempt(
-            user_id=user_id,
-            quiz_id=quiz_id,
-            start_time=datetime.utcnow()
-        )
-        db.session.add(attempt)
-        db.session.commit()
-        
         return {
-            'attempt_id': attempt.id,
-            'start_time': attempt.start_time.isoformat() + 'Z'
-        }, 201
+            'attempt_id': state['attempt_id'],
+            'start_time': state['start_time']
+        }, status
 
 class SubmitQuiz(Resource):
     def post(self, quiz_id):
@@ -157,45 +170,69 @@ class SubmitQuiz(Resource):
         if not user_id:
             return {'error': 'User ID is required'}, 400
 
-        # Check for existing attempt (both completed and in-progress)
-        attempt = QuizAttempt.query.filter_by(
-            user_id=user_id,
-            quiz_id=quiz_id
-        ).first()
-        
-        print(f"SubmitQuiz: Looking for attempt for user {user_id} on quiz {quiz_id}")
-        print(f"SubmitQuiz: Found attempt: {attempt}")
-        
-        if not attempt:
+        # Reject known duplicates from the attempt state cache before touching the database
+        found, state = get_attempt_state(user_id, quiz_id)
+        if found and state is None:
             return {'error': 'No quiz attempt found'}, 400
-            
-        if attempt.end_time is not None:
+        if state and state['completed']:
             return {'error': 'Quiz already submitted'}, 400
 
         # Calculate time spent
-        quiz = Quiz.query.get_or_404(quiz_id)
-        time_spent = (quiz.duration * 60) - data.get('time_remaining', 0)
+        quiz = get_quiz_meta(quiz_id)
+        if not quiz:
+            return {'error': 'Quiz not found'}, 404
+        time_spent = (quiz['duration'] * 60) - data.get('time_remaining', 0)
+        # Validate before queueing; a malformed payload must never reach the batch writer
+        try:
+            answers = clean_answers(data.get('answers', {}))
+        except ValueError as e:
+            return {'error': str(e)}, 400
 
-        # Update attempt
-        attempt.end_time = datetime.utcnow()
-        attempt.time_spent = time_spent
-        
-        # Get all questions for this quiz
-        questions = Question.query.filter_by(quiz_id=quiz_id).all()
-        
-        # Create score records for all questions
-        for question in questions:
-            selected_option = data.get('answers', {}).get(str(question.id))
-            score = Score(
-                user_id=int(user_id),
-                quiz_id=quiz_id,
-                question_id=question.id,
-                selected_option=selected_option,
-                attempt_id=attempt.id
-            )
-            db.session.add(score)
+        attempt = None
+        if state is None or not current_app.config['SUBMIT_QUEUE_ENABLED']:
+            # Check for existing attempt (both completed and in-progress)
+            attempt = QuizAttempt.query.filter_by(
+                user_id=user_id,
+                quiz_id=quiz_id
+            ).first()
+            
+            print(f"SubmitQuiz: Looking for attempt for user {user_id} on quiz {quiz_id}")
+            print(f"SubmitQuiz: Found attempt: {attempt}")
+            
+            if not attempt:
+                return {'error': 'No quiz attempt found'}, 400
+                
+            if attempt.end_time is not None:
+                return {'error': 'Quiz already submitted'}, 400
+            state = state_from_attempt(attempt.id, quiz_id, quiz['chapter_id'], attempt.start_time, None)
+
+        # Under end-of-quiz surges, queue the payload and let Celery write it in batches
+        if current_app.config['SUBMIT_QUEUE_ENABLED']:
+            db.session.close()
+            if not enqueue_submission(state['attempt_id'], quiz_id, answers, time_spent):
+                return {'error': 'Quiz already submitted'}, 400
+            state['end_time'] = datetime.utcnow().isoformat() + 'Z'
+            state['completed'] = True
+            state['grading_pending'] = True
+            set_attempt_state(user_id, state)
+            print(f"SubmitQuiz: Queued submission of quiz {quiz_id} for user {user_id}")
+            return {
+                'message': 'Quiz submission accepted',
+                'attempt_id': state['attempt_id'],
+                'status': 'pending'
+            }, 202
+
+        # Grade against the cached answer key and insert all scores in a single executemany
+        rows = apply_submission(attempt, get_answer_key(quiz_id), answers, time_spent, datetime.utcnow())
+        if rows:
+            db.session.execute(insert(Score), rows)
+        record_attempts_completed([(attempt, quiz)])
 
         db.session.commit()
+        set_attempt_state(user_id, state_from_attempt(
+            attempt.id, quiz_id, quiz['chapter_id'], attempt.start_time, attempt.end_time
+        ))
+        store_snapshots([attempt])
         print(f"SubmitQuiz: Successfully submitted quiz {quiz_id} for user {user_id}")
         return {'message': 'Quiz submitted successfully'}, 200    
 
@@ -208,18 +245,67 @@ class QuizAttemptStatus(Resource):
         if not current_user_id:
             return {'error': 'User ID is required'}, 401
         
-        # Get all quiz attempts for this user in the chapter
-        attempts = QuizAttempt.query.filter_by(
-            user_id=int(current_user_id)
-        ).join(Quiz).filter(
-            Quiz.chapter_id == chapter_id
-        ).all()
+        if chapter_id is None:
+            return []
+        
+        # Get all quiz attempts for this user in the chapter from the attempt state hash;
+        # moving a quiz to another chapter drops its cached states (AdminQuiz.put)
+        states = load_attempt_states(current_user_id)
         
         # Return just the quiz IDs
         return [{
-            'quiz_id': a.quiz_id,
+            'quiz_id': quiz_id,
             'attempted': True
-        } for a in attempts]     
+        } for quiz_id, state in states.items() if state['chapter_id'] == int(chapter_id)]
+
+
+# A quiz listing page never shows more quizzes than this
+MAX_STATUS_QUIZ_IDS = 500
+
+class QuizAttemptStatusBatch(Resource):
+    def post(self):
+        data = request.get_json()
+        current_user_id = data.get('user_id')
+        quiz_ids = data.get('quiz_ids')
+        chapter_id = data.get('chapter_id')
+        subject_id = data.get('subject_id')
+        
+        if not current_user_id:
+            return {'error': 'User ID is required'}, 401
+        
+        # Resolve the quizzes on the page from an explicit list, a chapter or a subject
+        if quiz_ids is not None:
+            if not isinstance(quiz_ids, list) or len(quiz_ids) > MAX_STATUS_QUIZ_IDS:
+                return {'error': f'quiz_ids must be a list of at most {MAX_STATUS_QUIZ_IDS} ids'}, 400
+            try:
+                quiz_ids = [int(quiz_id) for quiz_id in quiz_ids]
+            except (TypeError, ValueError):
+                return {'error': 'quiz_ids must be numeric'}, 400
+        elif chapter_id is not None:
+            try:
+                chapter_id = int(chapter_id)
+            except (TypeError, ValueError):
+                return {'error': 'chapter_id must be numeric'}, 400
+            quiz_ids = [quiz_id for (quiz_id,) in db.session.query(Quiz.id).filter(
+                Quiz.chapter_id == chapter_id
+            ).all()]
+        elif subject_id is not None:
+            try:
+                subject_id = int(subject_id)
+            except (TypeError, ValueError):
+                return {'error': 'subject_id must be numeric'}, 400
+            quiz_ids = [quiz_id for (quiz_id,) in db.session.query(Quiz.id).join(Chapter).filter(
+                Chapter.subject_id == subject_id
+            ).all()]
+        else:
+            return {'error': 'quiz_ids, chapter_id or subject_id is required'}, 400
+        
+        # One attempt state read (or one indexed query on a miss) covers every quiz
+        states = load_attempt_states(current_user_id)
+        return [
+            dict(attempt_status(states.get(quiz_id)), quiz_id=quiz_id)
+            for quiz_id in quiz_ids
+        ], 200
 
 
 # In quiz_controller.py, update the UserQuizAttempts class
@@ -235,26 +321,22 @@ class UserQuizAttempts(Resource):
         attempts = QuizAttempt.query.filter_by(user_id=int(user_id)).options(
             joinedload(QuizAttempt.quiz)
                 .joinedload(Quiz.chapter)
-                .joinedload(Chapter.subject),
-            joinedload(QuizAttempt.quiz)
-                .joinedload(Quiz.questions)
+                .joinedload(Chapter.subject)
         ).order_by(QuizAttempt.start_time.desc()).all()
 
         if not attempts:
             return jsonify([])
 
+        # Completed attempts carry their result; count questions for the rest in one grouped query
+        attempt_grades = attempt_results(a for a in attempts if a.end_time is not None)
+        quiz_question_counts = question_counts({a.quiz_id for a in attempts if a.end_time is None})
+
         results = []
         for attempt in attempts:
-            # Retrieve all scores for this attempt
-            scores = Score.query.filter_by(attempt_id=attempt.id).all()
-
-            # Count correct answers
-            correct_count = sum(
-                1 for score in scores
-                if score.selected_option == score.question.correct_option
-            )
-
-            total_questions = len(attempt.quiz.questions)
+            if attempt.id in attempt_grades:
+                correct_count, total_questions = attempt_grades[attempt.id]
+            else:
+                correct_count, total_questions = 0, quiz_question_counts.get(attempt.quiz_id, 0)
 
             results.append({
                 "attempt_id": attempt.id,
@@ -264,7 +346,7 @@ class UserQuizAttempts(Resource):
                 "end_time": attempt.end_time.isoformat() + "Z" if attempt.end_time else None,
                 "time_spent": attempt.time_spent,
                 "score": f"{correct_count}/{total_questions}",
-                "percentage": round((correct_count / total_questions) * 100) if total_questions > 0 else 0,
+                "percentage": percentage(correct_count, total_questions),
                 "chapter_id": attempt.quiz.chapter_id,
                 "subject_id": attempt.quiz.chapter.subject_id
             })
@@ -276,6 +358,7 @@ def register_quiz_routes(api):
     api.add_resource(StartQuiz, '/quizzes/<int:quiz_id>/start')
     api.add_resource(SubmitQuiz, '/quizzes/<int:quiz_id>/submit')
     api.add_resource(QuizAttemptStatus, '/quizzes/attempts')
+    api.add_resource(QuizAttemptStatusBatch, '/quizzes/attempts/batch')
     api.add_resource(QuizResults, '/quiz_attempts/<int:attempt_id>/results')
     api.add_resource(GetAttemptByQuiz, '/quizzes/attempt')
     api.add_resource(UserQuizAttempts, '/user/quiz_attempts')
\ No newline at end of file
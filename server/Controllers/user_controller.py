@@ -1,26 +1,34 @@
-from flask import jsonify, request
+from flask import jsonify, request, Response
 from flask_restful import Resource
 from models import Subject, Chapter, Quiz
-from sqlalchemy.orm import joinedload
-from extensions import cache
+from catalog_cache import get_or_set, SEARCH_TIMEOUT
+from quiz_cache import get_question_payload
 
 def register_user_routes(api): 
     class Subjects(Resource):   
-        # @cache.cached(timeout=30, key_prefix="user_subjects")
         def get(self):
+            return jsonify(get_or_set('user_subjects', ['subjects'], self.load))
+
+        @staticmethod
+        def load():
             subjects = Subject.query.all()
-            # time.sleep(1)
-            return jsonify([{
-                 'id': s.id,
+            return [{
+                'id': s.id,
                 'name': s.name,
                 'description': s.description
-            } for s in subjects])
+            } for s in subjects]
 
     class ChapterInSubject(Resource):
-        # @cache.cached(timeout=300, key_prefix=lambda: f"subject_{request.view_args['subject_id']}")
         def get(self, subject_id):
+            return jsonify(get_or_set(
+                f"subject_{subject_id}", [f"subject:{subject_id}"],
+                lambda: self.load(subject_id)
+            ))
+
+        @staticmethod
+        def load(subject_id):
             subject = Subject.query.get_or_404(subject_id)
-            return jsonify({
+            return {
                 'id': subject.id,
                 'name': subject.name,
                 'description': subject.description,
@@ -29,11 +37,17 @@ def register_user_routes(api):
                     'name': c.name,
                     'description': c.description
                 } for c in subject.chapters]
-            })
+            }
 
     class QuizesInChapter(Resource):
-        # @cache.cached(timeout=300, key_prefix=lambda: f"chapter_{request.view_args['chapter_id']}")
         def get(self, chapter_id):
+            return jsonify(get_or_set(
+                f"chapter_{chapter_id}", [f"chapter:{chapter_id}"],
+                lambda: self.load(chapter_id)
+            ))
+
+        @staticmethod
+        def load(chapter_id):
             chapter = Chapter.query.get_or_404(chapter_id)
             quizzes = []
             
@@ -46,7 +60,7 @@ def register_user_routes(api):
                     'remarks': q.remarks
                 })
                 
-            return jsonify({
+            return {
                 'id': chapter.id,
                 'name': chapter.name,
                 'description': chapter.description,
@@ -55,38 +69,16 @@ def register_user_routes(api):
                     'name': chapter.subject.name
                 },
                 'quizzes': quizzes
-            })
+            }
 
     class QuestionsInQuizz(Resource):
         def get(self, quiz_id):
-            quiz = Quiz.query.options(
-                joinedload(Quiz.chapter).joinedload(Chapter.subject)
-            ).get(quiz_id)
+            # Served as pre-serialized bytes; only a cache miss touches the database
+            payload = get_question_payload(quiz_id)
             
-            if not quiz:
+            if payload is None:
                 return {'error': 'Quiz not found'}, 404
-            return jsonify({
-                'id': quiz.id,
-                'start_time': quiz.start_time,
-                'end_time': quiz.end_time,
-                'duration': quiz.duration,
-                'chapter': {
-                    'id': quiz.chapter.id,
-                    'name': quiz.chapter.name,
-                    'subject': {
-                        'id': quiz.chapter.subject.id,
-                        'name': quiz.chapter.subject.name
-                    }
-                },
-                'questions': [{
-                    'id': q.id,
-                    'question_statement': q.question_statement,
-                    'option1': q.option1,
-                    'option2': q.option2,
-                    'option3': q.option3,
-                    'option4': q.option4,
-                } for q in quiz.questions]
-            })
+            return Response(payload, mimetype='application/json')
 
     api.add_resource(Subjects, '/subjects')
     api.add_resource(ChapterInSubject, '/subjects/<int:subject_id>')
@@ -104,6 +96,15 @@ def register_user_routes(api):
                     'quizzes': []
                 })
 
+            # ilike matching is case-insensitive, so one entry serves every casing
+            return jsonify(get_or_set(
+                f"search_{search_term.lower()}", ['search'],
+                lambda: self.load(search_term),
+                timeout=SEARCH_TIMEOUT
+            ))
+
+        @staticmethod
+        def load(search_term):
             # Search subjects
             subject_results = Subject.query.filter(
                 Subject.name.ilike(f'%{search_term}%')
@@ -123,7 +124,7 @@ def register_user_routes(api):
                 ) \
                 .all()
 
-            return jsonify({
+            return {
                 'subjects': [{
                     'id': s.id,
                     'name': s.name,
@@ -145,14 +146,18 @@ def register_user_routes(api):
                     'end_time': q.end_time.isoformat(),
                     'duration': q.duration
                 } for q in quiz_results]
-            })
+            }
     
     api.add_resource(SearchQuizzes, '/search')
 
     class ChapterSubjects(Resource):
         def get(self):
-            chapters = Chapter.query.options(joinedload(Chapter.subject)).all()
-            return jsonify({
-                c.id: c.subject.id for c in chapters
-            })
+            return jsonify(get_or_set('chapter_subjects', ['chapters'], self.load))
+
+        @staticmethod
+        def load():
+            chapters = Chapter.query.with_entities(Chapter.id, Chapter.subject_id).all()
+            return {
+                chapter_id: subject_id for chapter_id, subject_id in chapters
+            }
     api.add_resource(ChapterSubjects, '/chapters/subjects')
\ No newline at end of file
@@ -0,0 +1,178 @@
+import json
+from datetime import datetime, timedelta
+from redis import RedisError
+from sqlalchemy import func
+from extensions import redis_client
+from models import db, User, Subject, Chapter, QuizAttempt, DailyQuizStats
+from grading import percentage, score_histogram, histogram_labels, DISTRIBUTION_EDGES
+from rollups import rollup_totals, rollup_by, ist_day, ist_day_start
+from timeseries import time_series
+
+# The statistics behind the admin analytics page. Each /admin/stats/* resource
+# serves one of them; /admin/stats/dashboard serves all five from a snapshot
+# that refresh_dashboard_snapshots builds for every period the page offers in
+# a single read transaction, so the numbers on screen agree with each other.
+
+DASHBOARD_PERIODS = ('7', '30', '90', 'all')
+# Beat refreshes snapshots every minute; this only bounds how long a stopped beat serves old data
+DASHBOARD_TTL = 10 * 60
+QUIZ_HISTOGRAM_EDGES = tuple(range(10, 100, 10))
+
+def period_start(days):
+    """Return the UTC start of a 'days' query parameter, or None for 'all'; raises ValueError"""
+    if days == 'all':
+        return None
+    try:
+        return datetime.utcnow() - timedelta(days=int(days))
+    except OverflowError:
+        raise ValueError(f"Invalid days: {days}")
+
+def summary_stats(start_date=None, subject_id=None, role=None):
+    # Total users
+    users = User.query
+    if role:
+        users = users.filter(User.role == role)
+    total_users = users.count()
+
+    # Active users (logged in within the time range)
+    active_users = users
+    if start_date:
+        active_users = active_users.filter(User.last_visited >= start_date)
+    active_users_count = active_users.count()
+
+    # Quizzes taken and average score from the daily rollups
+    criteria = []
+    if start_date:
+        criteria.append(DailyQuizStats.day >= ist_day(start_date))
+    if subject_id is not None:
+        criteria.append(DailyQuizStats.subject_id == subject_id)
+    if role:
+        criteria.append(DailyQuizStats.user_role == role)
+    quizzes_taken_count, total_correct, total_questions = rollup_totals(*criteria)
+
+    return {
+        'totalUsers': total_users,
+        'activeUsers': active_users_count,
+        'quizzesTaken': quizzes_taken_count,
+        'avgScore': percentage(total_correct, total_questions, 1)
+    }
+
+def user_growth(start_date=None, granularity='day'):
+    # Sign-ups per IST day, week or month
+    series = time_series(
+        'user-growth', User.created_at, func.count(User.id), granularity,
+        since=ist_day(start_date) if start_date else None
+    )
+    return {
+        'labels': [bucket.isoformat() for bucket, _ in series],
+        'values': [count for _, count in series]
+    }
+
+def subject_performance():
+    subjects = db.session.query(Subject.id, Subject.name).all()
+    subject_grades = rollup_by(DailyQuizStats.subject_id)
+    subject_data = []
+
+    for subject_id, name in subjects:
+        _, total_correct, total_questions = subject_grades.get(subject_id, (0, 0, 0))
+        subject_data.append({
+            'subject': name,
+            'avg_score': percentage(total_correct, total_questions, 1)
+        })
+
+    # Sort by average score descending
+    subject_data.sort(key=lambda x: x['avg_score'], reverse=True)
+
+    return {
+        'labels': [s['subject'] for s in subject_data],
+        'values': [s['avg_score'] for s in subject_data]
+    }
+
+def quiz_activity(start_date=None, granularity='day'):
+    # Completed attempts per IST day, week or month from the daily rollups
+    series = time_series(
+        'quiz-activity', DailyQuizStats.day, func.sum(DailyQuizStats.completions), granularity,
+        since=ist_day(start_date) if start_date else None, tz=None
+    )
+    return {
+        'labels': [bucket.isoformat() for bucket, _ in series],
+        'values': [count for _, count in series]
+    }
+
+def performance_distribution(edges=DISTRIBUTION_EDGES, subject_id=None, quiz_id=None, from_day=None, to_day=None):
+    """Count graded attempts per score bucket, highest bucket first.
+
+    With the default edges that is [excellent (90-100%), good (75-89%),
+    average (60-74%), needs improvement (<60%)]. from_day / to_day are
+    inclusive IST days matched against the submission time.
+    """
+    criteria = []
+    if subject_id is not None:
+        criteria.append(Chapter.subject_id == subject_id)
+    if quiz_id is not None:
+        criteria.append(QuizAttempt.quiz_id == quiz_id)
+    if from_day:
+        criteria.append(QuizAttempt.end_time >= ist_day_start(from_day))
+    if to_day:
+        criteria.append(QuizAttempt.end_time < ist_day_start(to_day + timedelta(days=1)))
+    return score_histogram(edges, *criteria)[::-1]
+
+def quiz_histogram(quiz_id, edges=QUIZ_HISTOGRAM_EDGES):
+    return {
+        'labels': histogram_labels(edges),
+        'values': score_histogram(edges, QuizAttempt.quiz_id == quiz_id)
+    }
+
+def _dashboard_key(days):
+    return f"stats:dashboard:{days}"
+
+def build_dashboards(periods):
+    """Return {days: dashboard} for each period, computed in one read transaction"""
+    # Start a fresh transaction; on Postgres every query below then reads the same snapshot
+    db.session.close()
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.connection(execution_options={'isolation_level': 'REPEATABLE READ'})
+
+    try:
+        generated_at = datetime.utcnow().isoformat() + 'Z'
+        subjects = subject_performance()
+        distribution = performance_distribution()
+
+        dashboards = {}
+        for days in periods:
+            start_date = period_start(days)
+            dashboards[days] = {
+                'days': days,
+                'generated_at': generated_at,
+                'summary': summary_stats(start_date),
+                'user_growth': user_growth(start_date),
+                'subject_performance': subjects,
+                'quiz_activity': quiz_activity(start_date),
+                'performance_distribution': distribution
+            }
+    finally:
+        db.session.close()
+    return dashboards
+
+def refresh_dashboard_snapshots(periods=DASHBOARD_PERIODS):
+    """Rebuild and store dashboard snapshots; returns {days: encoded snapshot}"""
+    snapshots = {days: json.dumps(dashboard).encode('utf-8')
+                 for days, dashboard in build_dashboards(periods).items()}
+    try:
+        pipe = redis_client.pipeline()
+        for days, body in snapshots.items():
+            pipe.set(_dashboard_key(days), body, ex=DASHBOARD_TTL)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to store dashboard snapshots: {str(e)}")
+    return snapshots
+
+def get_dashboard_snapshot(days):
+    """Return the stored JSON snapshot for a period, building it if beat has not yet"""
+    try:
+        body = redis_client.get(_dashboard_key(days))
+    except RedisError:
+        body = None
+    if body is None:
+        body = refresh_dashboard_snapshots([days])[days]
+    return body
@@ -1,13 +1,95 @@
+import asyncio
 import os
+import random
+import threading
+import time
+from groq import APIConnectionError, InternalServerError, RateLimitError
 from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
 from sqlalchemy.orm import joinedload
-from models import QuizAttempt, Score, Quiz, Chapter
+from models import QuizAttempt, Quiz, Chapter
+from grading import attempt_results, percentage
+
+# Monthly AI reports are generated in batches: prompts go to the chat model's
+# async interface concurrently (at most AI_MAX_CONCURRENCY in flight) and a
+# token bucket keeps the batch under the provider's requests-per-minute and
+# tokens-per-minute quotas, instead of sleeping between users. Rate limit,
+# connection and provider-side errors are retried with exponential backoff
+# (or the provider's Retry-After), waiting outside the concurrency slot; any
+# other error fails that report right away. AI_REPORT_LLM=fake swaps in
+# LangChain's FakeListChatModel so the whole pipeline runs offline.
+
+AI_REQUESTS_PER_MINUTE = int(os.getenv('AI_REQUESTS_PER_MINUTE', 30))
+AI_TOKENS_PER_MINUTE = int(os.getenv('AI_TOKENS_PER_MINUTE', 30000))
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 8))
+AI_MAX_RETRIES = 4
+# Reserved per call on top of the prompt, then corrected from the reported usage
+COMPLETION_TOKEN_ESTIMATE = 1000
+# APITimeoutError is an APIConnectionError
+TRANSIENT_ERRORS = (RateLimitError, APIConnectionError, InternalServerError, TimeoutError, ConnectionError)
+
+FAKE_REPORT = """1. EXECUTIVE SUMMARY:
+This is a placeholder report from the offline fake model."""
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared by concurrent calls"""
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.capacity = (requests_per_minute, tokens_per_minute)
+        self.available = list(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        # Take a request and the tokens if both buckets hold them, else return the seconds to wait
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated
+            self.updated = now
+            self.available = [min(capacity, available + elapsed * capacity / 60)
+                              for capacity, available in zip(self.capacity, self.available)]
+
+            needed = (1, min(tokens, self.capacity[1]))
+            wait = max((need - available) * 60 / capacity
+                       for need, available, capacity in zip(needed, self.available, self.capacity))
+            if wait > 0:
+                return wait
+            self.available = [available - need for need, available in zip(needed, self.available)]
+            return 0
+
+    async def acquire(self, tokens):
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def adjust(self, tokens):
+        """Charge the tokens a call used beyond its reservation (negative refunds them)"""
+        with self.lock:
+            self.available[1] -= tokens
+
+def _retry_delay(error, attempt):
+    response = getattr(error, 'response', None)
+    try:
+        delay = float(response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        delay = min(60, 2 ** attempt)
+    return delay + random.uniform(0, 1)
 
 class AIReportGenerator:
-    def __init__(self):
-        self.llm = ChatGroq(
+    def __init__(self, llm=None):
+        # Any LangChain chat model can be passed in, e.g. a fake one in tests
+        self.custom_llm = llm is not None
+        self.llm = llm or self._default_llm()
+        self.limiter = RateLimiter(AI_REQUESTS_PER_MINUTE, AI_TOKENS_PER_MINUTE)
+
+    @staticmethod
+    def _default_llm():
+        if os.getenv('AI_REPORT_LLM') == 'fake':
+            return FakeListChatModel(responses=[FAKE_REPORT])
+        return ChatGroq(
             model="llama-3.1-70b-versatile",
             groq_api_key=os.getenv('GROQ_API_KEY'),
             temperature=0.7
@@ -28,22 +110,21 @@ class AIReportGenerator:
             .joinedload(Chapter.subject)
         ).all()
         
-        # Calculate quiz performance
+        # Results are materialized per attempt; only legacy rows are regraded
+        attempt_grades = attempt_results(quiz_attempts)
+        
+        # Calculate quiz and subject-wise performance
         quiz_performance = []
+        subject_performance = {}
         total_correct = 0
         total_questions = 0
         
         for attempt in quiz_attempts:
-            scores = Score.query.filter_by(attempt_id=attempt.id).all()
-            correct_in_attempt = sum(
-                1 for score in scores 
-                if score.selected_option == score.question.correct_option
-            )
-            total_in_attempt = len(scores)
+            correct_in_attempt, total_in_attempt = attempt_grades.get(attempt.id, (0, 0))
             
             quiz_performance.append({
                 'quiz_name': f"{attempt.quiz.chapter.subject.name} - {attempt.quiz.chapter.name}",
-                'score_percentage': round((correct_in_attempt / total_in_attempt) * 100, 1) if total_in_attempt else 0,
+                'score_percentage': percentage(correct_in_attempt, total_in_attempt, 1),
                 'correct_answers': correct_in_attempt,
                 'total_questions': total_in_attempt,
                 'completion_date': attempt.end_time.strftime('%Y-%m-%d')
@@ -51,21 +132,10 @@ class AIReportGenerator:
             
             total_correct += correct_in_attempt
             total_questions += total_in_attempt
-        
-        # Calculate subject-wise performance
-        subject_performance = {}
-        for attempt in quiz_attempts:
+            
             subject_name = attempt.quiz.chapter.subject.name
             if subject_name not in subject_performance:
                 subject_performance[subject_name] = {'correct': 0, 'total': 0}
-            
-            scores = Score.query.filter_by(attempt_id=attempt.id).all()
-            correct_in_attempt = sum(
-                1 for score in scores 
-                if score.selected_option == score.question.correct_option
-            )
-            total_in_attempt = len(scores)
-            
             subject_performance[subject_name]['correct'] += correct_in_attempt
             subject_performance[subject_name]['total'] += total_in_attempt
         
@@ -92,9 +162,32 @@ class AIReportGenerator:
             'total_questions': total_questions
         }
     
-    def generate_insightful_report(self, user_data, user_name, month):
-        """Generate AI-powered insightful report using Groq"""
-        
+    @staticmethod
+    def performance_data_from_report(report):
+        """Convert a reports.iter_monthly_reports report into get_user_performance_data's format"""
+        subject_breakdown = sorted(({
+            'subject': subject['name'],
+            'accuracy': subject['accuracy'],
+            'correct': subject['correct'],
+            'total': subject['total']
+        } for subject in report['subject_breakdown']), key=lambda x: x['accuracy'])
+        return {
+            'quiz_performance': [{
+                'quiz_name': quiz['quiz_name'],
+                'score_percentage': quiz['score'],
+                'correct_answers': quiz['correct'],
+                'total_questions': quiz['total'],
+                'completion_date': quiz['date']
+            } for quiz in report['quiz_history']],
+            'subject_breakdown': subject_breakdown,
+            'total_quizzes': report['quiz_count'],
+            'overall_accuracy': report['avg_score'],
+            'total_correct': sum(subject['correct'] for subject in subject_breakdown),
+            'total_questions': sum(subject['total'] for subject in subject_breakdown)
+        }
+
+    def build_prompt(self, user_data, user_name, month):
+        """Format the report prompt for one student's performance data"""
         prompt_template = PromptTemplate(
             input_variables=["user_name", "month", "quiz_performance", "subject_breakdown", "overall_stats"],
             template="""
@@ -166,13 +259,17 @@ class AIReportGenerator:
             'total_correct': user_data['total_correct']
         }
         
-        prompt = prompt_template.format(
+        return prompt_template.format(
             user_name=user_name,
             month=month,
             quiz_performance=formatted_quiz_performance,
             subject_breakdown=formatted_subject_breakdown,
             overall_stats=overall_stats
         )
+
+    def generate_insightful_report(self, user_data, user_name, month):
+        """Generate AI-powered insightful report using Groq"""
+        prompt = self.build_prompt(user_data, user_name, month)
         
         try:
             response = self.llm.invoke([HumanMessage(content=prompt)])
@@ -180,5 +277,50 @@ class AIReportGenerator:
         except Exception as e:
             return f"Unable to generate AI-powered report at this time. Error: {str(e)}"
 
+    async def _agenerate(self, llm, prompt, semaphore):
+        # Rough token count for the prompt; the reservation is corrected from usage_metadata
+        reserved = len(prompt) // 4 + COMPLETION_TOKEN_ESTIMATE
+        for attempt in range(AI_MAX_RETRIES + 1):
+            try:
+                async with semaphore:
+                    await self.limiter.acquire(reserved)
+                    response = await llm.ainvoke([HumanMessage(content=prompt)])
+            except TRANSIENT_ERRORS as e:
+                if attempt == AI_MAX_RETRIES:
+                    return f"Unable to generate AI-powered report at this time. Error: {str(e)}"
+                # Back off without holding a slot, so other reports keep going meanwhile
+                await asyncio.sleep(_retry_delay(e, attempt))
+                continue
+            except Exception as e:
+                return f"Unable to generate AI-powered report at this time. Error: {str(e)}"
+
+            usage = getattr(response, 'usage_metadata', None)
+            if usage:
+                self.limiter.adjust(usage['total_tokens'] - reserved)
+            return response.content
+
+    async def agenerate_reports(self, requests, llm=None):
+        """Generate reports for [(user_data, user_name, month)] concurrently, in the same order"""
+        semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        return await asyncio.gather(*(
+            self._agenerate(llm or self.llm, self.build_prompt(user_data, user_name, month), semaphore)
+            for user_data, user_name, month in requests
+        ))
+
+    def generate_reports(self, batches):
+        """Blocking wrapper for Celery tasks: yield the reports for each batch of requests in turn.
+
+        Every batch runs in one event loop with a model built for it, because a
+        chat model's async HTTP client stays bound to the loop it first ran in.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            llm = self.llm if self.custom_llm else self._default_llm()
+            for requests in batches:
+                yield loop.run_until_complete(self.agenerate_reports(requests, llm))
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
 # Singleton instance
 ai_report_generator = AIReportGenerator()
\ No newline at end of file
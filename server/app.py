@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, send_file
 from models import db, User, Role
 from flask_restful import Api
 from Controllers.Basic import register_routes
@@ -12,6 +12,11 @@ from celery import Celery
 from celery.schedules import crontab
 from flask_mail import Mail
 from extensions import cache, limiter
+from exports import EXPORT_FORMATS, EXPORT_MODES
+from export_jobs import request_export
+from artifacts import open_download
+from migrations import upgrade
+from itsdangerous import BadSignature, SignatureExpired
 
 load_dotenv()
 
@@ -52,6 +57,14 @@ app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'noreply@qu
 app.config['CACHE_TYPE'] = 'RedisCache'
 app.config['CACHE_REDIS_URL'] = REDIS_URL
 app.config['CACHE_DEFAULT_TIMEOUT'] = 300
+app.config['SUBMIT_QUEUE_ENABLED'] = os.getenv('SUBMIT_QUEUE_ENABLED', 'False') == 'True'
+app.config['QUIZ_PREWARM_MINUTES'] = int(os.getenv('QUIZ_PREWARM_MINUTES', 10))
+# Chunk files of partitioned exports; must be shared by every Celery worker
+app.config['EXPORT_SPOOL_DIR'] = os.getenv('EXPORT_SPOOL_DIR')
+app.config['EXPORT_PARTITION_SIZE'] = int(os.getenv('EXPORT_PARTITION_SIZE', 50000))
+# Finished exports; must be shared by the Celery workers and the web app that serves downloads
+app.config['EXPORT_ARTIFACT_DIR'] = os.getenv('EXPORT_ARTIFACT_DIR')
+app.config['EXPORT_DOWNLOAD_URL'] = os.getenv('EXPORT_DOWNLOAD_URL', 'http://localhost:5000/api/export/download')
 
 db.init_app(app)
 jwt = JWTManager(app)
@@ -91,6 +104,8 @@ def create_celery(app):
                 return self.run(*args, **kwargs)
     celery.Task = ContextTask
     celery.autodiscover_tasks(['celery_worker']) 
+    # Lets the controllers enqueue tasks without importing this module
+    app.extensions['celery'] = celery
     return celery
 celery = create_celery(app)
 celery.conf.beat_schedule = {
@@ -140,6 +155,21 @@ def trigger_report_email_task():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+SHARED_EXPORT_MESSAGES = {
+    'start': "{name} export started! You'll receive an email shortly.",
+    'ready': "{name} export is ready! You'll receive an email shortly.",
+    'attached': "An identical export is already running. You'll receive it by email when it finishes."
+}
+
+def queue_shared_export(export_type, export_format, recipient_email, task_name, args):
+    """Start, join or reuse the export job for the current data; returns the action taken"""
+    action, job_key, job = request_export(export_type, export_format, recipient_email)
+    if action == 'start':
+        celery.send_task(task_name, args=[*args, job_key])
+    elif action == 'ready':
+        celery.send_task('celery_worker.send_export', args=[[recipient_email], job])
+    return action
+
 @app.route('/api/export/scores-csv', methods=['GET'])
 @limiter.limit("2 per 30 minute") 
 @jwt_required()
@@ -150,11 +180,42 @@ def trigger_scores_export():
         if not user or user.role != Role.ADMIN:
             return jsonify({"error": "Admin access required"}), 403
         
-        celery.send_task('celery_worker.export_scores_csv', args=[user.email])
-        return jsonify({"message": "Scores export started! You'll receive an email shortly."}), 200
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+        # incremental: only scores added since this admin's previous export
+        mode = request.args.get('mode', 'full')
+        if mode not in EXPORT_MODES:
+            return jsonify({"error": f"mode must be one of {', '.join(EXPORT_MODES)}"}), 400
+        
+        if mode == 'incremental':
+            # Watermarks are per recipient, so incremental exports are never shared
+            celery.send_task('celery_worker.export_scores_csv', args=[user.email, export_format, mode])
+            return jsonify({"message": "Scores export started! You'll receive an email shortly."}), 200
+
+        action = queue_shared_export('scores', export_format, user.email,
+                                     'celery_worker.export_scores_csv', [user.email, export_format, mode])
+        return jsonify({"message": SHARED_EXPORT_MESSAGES[action].format(name="Scores"), "status": action}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/export/download/<token>', methods=['GET'])
+def download_export(token):
+    # The signed token from the export email is the credential, so no login is needed
+    try:
+        path, filename, mimetype = open_download(token)
+    except SignatureExpired:
+        return jsonify({"error": "This download link has expired"}), 410
+    except BadSignature:
+        return jsonify({"error": "Invalid download link"}), 404
+    except FileNotFoundError:
+        return jsonify({"error": "This export is no longer available"}), 410
+
+    # Streams the file in blocks and answers Range / If-Range requests with 206
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=filename,
+                     conditional=True, max_age=0)
+
 @app.route('/api/export/my-performance-csv', methods=['GET'])
 @limiter.limit("2 per 30 minute") 
 @jwt_required()
@@ -165,7 +226,11 @@ def trigger_my_performance_export():
         if not user:
             return jsonify({"error": "User not found"}), 404
         
-        celery.send_task('celery_worker.export_user_performance_csv', args=[user.email, user_id])
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        celery.send_task('celery_worker.export_user_performance_csv', args=[user.email, user_id, export_format])
         return jsonify({"message": "Performance export started! You'll receive an email shortly."}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -180,8 +245,14 @@ def trigger_all_performance_export():
         if not user or user.role != Role.ADMIN:
             return jsonify({"error": "Admin access required"}), 403
         
-        celery.send_task('celery_worker.export_user_performance_csv', args=[user.email])
-        return jsonify({"message": "All users performance export started! You'll receive an email shortly."}), 200
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+        
+        action = queue_shared_export('all-performance', export_format, user.email,
+                                     'celery_worker.export_user_performance_csv', [user.email, None, export_format])
+        return jsonify({"message": SHARED_EXPORT_MESSAGES[action].format(name="All users performance"),
+                        "status": action}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -241,6 +312,30 @@ celery.conf.beat_schedule = {
     'monthly-reports': {
         'task': 'celery_worker.send_ai_enhanced_monthly_reports',  # Updated to use AI reports
         'schedule': crontab(day_of_month=1, hour=14, minute=30)
+    },
+    'prewarm-upcoming-quizzes': {
+        'task': 'celery_worker.prewarm_upcoming_quizzes',
+        'schedule': crontab(minute='*'),
+    },
+    'drain-submission-stream': {
+        'task': 'celery_worker.drain_submission_stream',
+        'schedule': 5.0
+    },
+    'backfill-attempt-results': {
+        'task': 'celery_worker.backfill_attempt_results',
+        'schedule': crontab(minute=0)
+    },
+    'refresh-dashboard-stats': {
+        'task': 'celery_worker.refresh_dashboard_stats',
+        'schedule': crontab(minute='*'),
+    },
+    'purge-export-artifacts': {
+        'task': 'celery_worker.purge_export_artifacts',
+        'schedule': crontab(minute='*/15')
+    },
+    'reconcile-daily-stats': {
+        'task': 'celery_worker.reconcile_daily_stats',
+        'schedule': crontab(hour=20, minute=45)  # 02:15 IST
     }
 }
 
@@ -253,7 +348,7 @@ def ratelimit_handler(e):
 
 if __name__ == "__main__":
     with app.app_context():
-        db.create_all()
+        upgrade()
         create_admin_user()
         register_routes(api)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,58 @@
+import glob
+import os
+import tempfile
+import time
+import uuid
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer
+
+# Finished exports live in EXPORT_ARTIFACT_DIR, a directory shared by the
+# workers that write them and the web app that serves them. Emails carry a
+# signed link to /api/export/download/<token> instead of the file; the token
+# names the artifact and expires after DOWNLOAD_LINK_TTL. Shared export jobs
+# hand out new links for an artifact during REUSE_WINDOW, so files are kept
+# until the last link minted for them has expired.
+
+DOWNLOAD_LINK_TTL = 24 * 60 * 60
+REUSE_WINDOW = 60 * 60
+ARTIFACT_RETENTION = REUSE_WINDOW + DOWNLOAD_LINK_TTL + 10 * 60
+TOKEN_SALT = 'export-download'
+
+def artifact_dir():
+    directory = current_app.config.get('EXPORT_ARTIFACT_DIR') or os.path.join(tempfile.gettempdir(), 'quizlytics-exports')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def artifact_path(suffix, name=None):
+    """Path of a new artifact, named after name when given (shared jobs) or a random id"""
+    return os.path.join(artifact_dir(), f"artifact-{name or uuid.uuid4().hex}{suffix}")
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+def download_url(path, filename, mimetype):
+    """Return a signed link to an artifact, valid for DOWNLOAD_LINK_TTL"""
+    token = _serializer().dumps({'artifact': os.path.basename(path), 'filename': filename, 'mimetype': mimetype})
+    return f"{current_app.config['EXPORT_DOWNLOAD_URL'].rstrip('/')}/{token}"
+
+def open_download(token):
+    """Return (path, filename, mimetype) for a download token.
+
+    Raises itsdangerous' SignatureExpired / BadSignature for expired or
+    forged tokens and FileNotFoundError once the artifact was purged.
+    """
+    payload = _serializer().loads(token, max_age=DOWNLOAD_LINK_TTL)
+    path = os.path.join(artifact_dir(), os.path.basename(payload['artifact']))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(payload['artifact'])
+    return path, payload['filename'], payload['mimetype']
+
+def purge_artifacts(max_age=ARTIFACT_RETENTION):
+    """Remove artifacts older than max_age seconds, by which time every link to them has expired"""
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in glob.glob(os.path.join(artifact_dir(), 'artifact-*')):
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,138 @@
+import json
+from redis import RedisError
+from sqlalchemy.dialects import postgresql, sqlite
+from extensions import redis_client
+from models import db, QuizAttempt, Quiz
+
+# Attempt state per user lives in a Redis hash (quiz_id -> attempt summary),
+# written through by StartQuiz and SubmitQuiz, so the start and status
+# endpoints the frontend polls are answered without touching the database.
+# The LOADED_FIELD marker means the hash holds every attempt of that user,
+# which lets a missing field be read as "no attempt". Every lookup falls back
+# to the database when Redis is unavailable.
+
+STATE_TTL = 24 * 60 * 60
+LOADED_FIELD = '_loaded'
+
+def _state_key(user_id):
+    return f"attempts:user:{user_id}"
+
+def _isoformat(dt):
+    return dt.isoformat() + 'Z' if dt else None
+
+def state_from_attempt(attempt_id, quiz_id, chapter_id, start_time, end_time, grading_pending=False):
+    return {
+        'attempt_id': attempt_id,
+        'quiz_id': quiz_id,
+        'chapter_id': chapter_id,
+        'start_time': _isoformat(start_time),
+        'end_time': _isoformat(end_time),
+        'completed': end_time is not None,
+        'grading_pending': grading_pending
+    }
+
+def get_attempt_state(user_id, quiz_id):
+    """Return (found, state). found is False on a cache miss; state is None when the user has no attempt."""
+    try:
+        state, loaded = redis_client.hmget(_state_key(user_id), str(quiz_id), LOADED_FIELD)
+    except RedisError:
+        return False, None
+    if state:
+        return True, json.loads(state)
+    return bool(loaded), None
+
+def set_attempt_states(states):
+    """Write through [(user_id, state), ...] in one round trip"""
+    try:
+        pipe = redis_client.pipeline()
+        for user_id, state in states:
+            pipe.hset(_state_key(user_id), str(state['quiz_id']), json.dumps(state))
+            pipe.expire(_state_key(user_id), STATE_TTL)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to cache attempt state: {str(e)}")
+
+def set_attempt_state(user_id, state):
+    set_attempt_states([(user_id, state)])
+
+def forget_attempt_state(user_id, quiz_id=None):
+    """Drop one cached quiz entry for a user, or all of them"""
+    try:
+        if quiz_id is None:
+            redis_client.delete(_state_key(user_id))
+        else:
+            # The hash no longer holds every attempt, so drop the loaded marker too
+            redis_client.hdel(_state_key(user_id), str(quiz_id), LOADED_FIELD)
+    except RedisError as e:
+        print(f"Failed to clear attempt state for user {user_id}: {str(e)}")
+
+def forget_quiz_states(quiz_id):
+    """Drop the cached entry for a quiz from every user who attempted it, e.g. after it moved chapter"""
+    user_ids = [user_id for (user_id,) in db.session.query(QuizAttempt.user_id).filter_by(quiz_id=quiz_id)]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hdel(_state_key(user_id), str(quiz_id), LOADED_FIELD)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to clear attempt state for quiz {quiz_id}: {str(e)}")
+
+def load_attempt_states(user_id):
+    """Return {quiz_id: state} for every attempt of the user, filling the hash from the DB on a miss"""
+    key = _state_key(user_id)
+    try:
+        cached = redis_client.hgetall(key)
+    except RedisError:
+        cached = None
+
+    if cached and LOADED_FIELD.encode() in cached:
+        return {int(field): json.loads(value) for field, value in cached.items()
+                if field != LOADED_FIELD.encode()}
+
+    rows = db.session.query(
+        QuizAttempt.id, QuizAttempt.quiz_id, Quiz.chapter_id,
+        QuizAttempt.start_time, QuizAttempt.end_time
+    ).join(Quiz, QuizAttempt.quiz_id == Quiz.id).filter(QuizAttempt.user_id == int(user_id)).all()
+    states = {row.quiz_id: state_from_attempt(*row) for row in rows}
+
+    if cached is not None:
+        try:
+            pipe = redis_client.pipeline()
+            # HSETNX so a write-through that raced this DB read is not overwritten
+            for quiz_id, state in states.items():
+                pipe.hsetnx(key, str(quiz_id), json.dumps(state))
+            pipe.hset(key, LOADED_FIELD, 1)
+            pipe.expire(key, STATE_TTL)
+            pipe.execute()
+        except RedisError as e:
+            print(f"Failed to cache attempt state for user {user_id}: {str(e)}")
+    return states
+
+def upsert_attempt(user_id, quiz_id, start_time):
+    """Insert an attempt or return the existing one in a single statement.
+
+    Returns (attempt_id, start_time, end_time, created). The conflict branch
+    rewrites user_id with itself so RETURNING yields the existing row. The
+    caller commits, so the start can be counted in the same transaction.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise NotImplementedError(f"Attempt upsert is not supported on {dialect}")
+
+    stmt = insert(QuizAttempt.__table__).values(
+        user_id=user_id,
+        quiz_id=quiz_id,
+        start_time=start_time
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['user_id', 'quiz_id'],
+        set_={'user_id': stmt.excluded.user_id}
+    ).returning(QuizAttempt.id, QuizAttempt.start_time, QuizAttempt.end_time)
+
+    row = db.session.execute(stmt).one()
+    # An existing attempt keeps its original start_time
+    return row.id, row.start_time, row.end_time, row.start_time == start_time
@@ -0,0 +1,137 @@
+"""Compare the scores export: joinedload + in-memory CSV vs the streaming gzip export.
+
+Usage: python benchmarks/export_benchmark.py [--rows 10000000] [--legacy-rows 200000]
+
+Seeds a synthetic Score table in BENCHMARK_DATABASE_URL (defaults to a
+temporary SQLite file) and prints rows/sec and peak Python memory for the
+streaming export over --rows scores. The original export, which loads every
+Score with its relationships, is run over the first --legacy-rows scores only;
+its memory grows with the row count (pass 0 to skip it).
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from sqlalchemy.orm import joinedload
+from models import db, User, Subject, Chapter, Quiz, Question, Score
+from exports import export_scores, spool_path
+
+SEED_BATCH_SIZE = 50000
+
+def create_app():
+    app = Flask(__name__)
+    database_url = os.getenv('BENCHMARK_DATABASE_URL')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'export_benchmark.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed(num_rows, num_users=1000, num_quizzes=20, questions_per_quiz=50):
+    now = datetime.utcnow()
+    subject = Subject(name='Benchmark')
+    db.session.add(subject)
+    db.session.flush()
+    chapters = [Chapter(name=f'Chapter {i}', subject_id=subject.id) for i in range(num_quizzes)]
+    db.session.add_all(chapters)
+    db.session.flush()
+    quizzes = [Quiz(chapter_id=chapter.id, start_time=now - timedelta(days=1),
+                    end_time=now, duration=60) for chapter in chapters]
+    db.session.add_all(quizzes)
+    db.session.flush()
+    questions = [Question(
+        quiz_id=quiz.id, question_statement=f'Question {i} of quiz {quiz.id}',
+        option1='a', option2='b', option3='c', option4='d',
+        correct_option=(i % 4) + 1
+    ) for quiz in quizzes for i in range(questions_per_quiz)]
+    db.session.add_all(questions)
+    users = [User(email=f'bench{i}@example.com', full_name=f'Bench {i}', password='x')
+             for i in range(num_users)]
+    db.session.add_all(users)
+    db.session.commit()
+
+    user_ids = [u.id for u in users]
+    question_rows = [(q.quiz_id, q.id) for q in questions]
+    for start in range(0, num_rows, SEED_BATCH_SIZE):
+        db.session.execute(insert(Score), [{
+            'user_id': user_ids[i % len(user_ids)],
+            'quiz_id': question_rows[i % len(question_rows)][0],
+            'question_id': question_rows[i % len(question_rows)][1],
+            'selected_option': (i % 5) or None,
+            'timestamp': now
+        } for i in range(start, min(start + SEED_BATCH_SIZE, num_rows))])
+        db.session.commit()
+
+def export_legacy(limit):
+    """The original task body: every Score with its relationships joinedloaded, CSV built in a StringIO.
+
+    Score has no quiz relationship, so the chain is loaded through the question.
+    """
+    scores = Score.query.options(
+        joinedload(Score.user),
+        joinedload(Score.question).joinedload(Question.quiz).joinedload(Quiz.chapter).joinedload(Chapter.subject)
+    ).order_by(Score.id).limit(limit).all()
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for score in scores:
+        writer.writerow([
+            score.user.id, score.user.full_name, score.user.email, score.quiz_id,
+            score.question.quiz.chapter.subject.name, score.question.quiz.chapter.name,
+            score.question.question_statement, score.selected_option,
+            score.question.correct_option, score.selected_option == score.question.correct_option,
+            score.timestamp.isoformat()
+        ])
+    content = output.getvalue()
+    db.session.expunge_all()
+    return len(scores), len(content)
+
+def export_streaming():
+    path = spool_path('.csv.gz')
+    try:
+        rows = export_scores(path)
+        return rows, os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+def run(label, export):
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows, size = export()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {rows} rows in {elapsed:.2f}s -> {rows / elapsed:.0f} rows/sec, "
+          f"output {size / 2**20:.1f} MiB, peak memory {peak / 2**20:.1f} MiB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--legacy-rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        started = time.perf_counter()
+        seed(args.rows)
+        print(f"Seeded {args.rows} scores in {time.perf_counter() - started:.1f}s")
+
+        if args.legacy_rows:
+            run('legacy', lambda: export_legacy(min(args.legacy_rows, args.rows)))
+        run('streaming', export_streaming)
+
+if __name__ == '__main__':
+    main()
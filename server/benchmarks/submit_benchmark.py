@@ -0,0 +1,117 @@
+"""Compare SubmitQuiz answer persistence: one ORM Score per question vs a bulk insert.
+
+Usage: python benchmarks/submit_benchmark.py [--submits 500] [--questions 100]
+
+Runs against BENCHMARK_DATABASE_URL (defaults to a temporary SQLite file) and
+prints submits/sec for both paths on the same quiz.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from models import db, User, Subject, Chapter, Quiz, Question, QuizAttempt, Score
+from grading import grade_answers, finalize_attempt
+from quiz_cache import load_answer_key
+from submissions import score_rows
+
+def create_app():
+    app = Flask(__name__)
+    database_url = os.getenv('BENCHMARK_DATABASE_URL')
+    if not database_url:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'submit_benchmark.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+def seed(num_users, num_questions):
+    now = datetime.utcnow()
+    subject = Subject(name='Benchmark')
+    db.session.add(subject)
+    db.session.flush()
+    chapter = Chapter(name='Benchmark', subject_id=subject.id)
+    db.session.add(chapter)
+    db.session.flush()
+    quiz = Quiz(chapter_id=chapter.id, start_time=now - timedelta(hours=1),
+                end_time=now + timedelta(hours=1), duration=60)
+    db.session.add(quiz)
+    db.session.flush()
+    db.session.add_all([Question(
+        quiz_id=quiz.id, question_statement=f'Question {i}',
+        option1='a', option2='b', option3='c', option4='d',
+        correct_option=(i % 4) + 1
+    ) for i in range(num_questions)])
+    users = [User(email=f'bench{i}@example.com', full_name=f'Bench {i}', password='x')
+             for i in range(num_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    return quiz.id, [u.id for u in users]
+
+def start_attempts(quiz_id, user_ids):
+    attempts = [QuizAttempt(user_id=user_id, quiz_id=quiz_id, start_time=datetime.utcnow())
+                for user_id in user_ids]
+    db.session.add_all(attempts)
+    db.session.commit()
+    return [a.id for a in attempts]
+
+def submit_orm(quiz_id, user_id, attempt_id, answers):
+    """The original path: load Question rows, add one Score object per question"""
+    attempt = db.session.get(QuizAttempt, attempt_id)
+    attempt.end_time = datetime.utcnow()
+    questions = Question.query.filter_by(quiz_id=quiz_id).all()
+    for question in questions:
+        db.session.add(Score(
+            user_id=user_id,
+            quiz_id=quiz_id,
+            question_id=question.id,
+            selected_option=answers.get(str(question.id)),
+            attempt_id=attempt.id
+        ))
+    db.session.commit()
+
+def submit_bulk(quiz_id, user_id, attempt_id, answers, answer_key):
+    """The current path: grade against the cached answer key and executemany the scores"""
+    attempt = db.session.get(QuizAttempt, attempt_id)
+    attempt.end_time = datetime.utcnow()
+    finalize_attempt(attempt, *grade_answers(answer_key, answers))
+    db.session.execute(insert(Score), score_rows(user_id, quiz_id, attempt.id, answer_key, answers, attempt.end_time))
+    db.session.commit()
+
+def run(label, submit, quiz_id, user_ids, attempt_ids, answers):
+    started = time.perf_counter()
+    for user_id, attempt_id in zip(user_ids, attempt_ids):
+        submit(quiz_id, user_id, attempt_id, answers)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<12} {len(attempt_ids)} submits in {elapsed:.2f}s -> {len(attempt_ids) / elapsed:.1f} submits/sec")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--submits', type=int, default=500)
+    parser.add_argument('--questions', type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        quiz_id, user_ids = seed(args.submits * 2, args.questions)
+        answer_key = load_answer_key(quiz_id)
+        answers = {str(question_id): 1 for question_id, _ in answer_key}
+
+        orm_users, bulk_users = user_ids[:args.submits], user_ids[args.submits:]
+        orm_attempts = start_attempts(quiz_id, orm_users)
+        bulk_attempts = start_attempts(quiz_id, bulk_users)
+
+        run('orm add', submit_orm, quiz_id, orm_users, orm_attempts, answers)
+        run('bulk insert', lambda q, u, a, ans: submit_bulk(q, u, a, ans, answer_key),
+            quiz_id, bulk_users, bulk_attempts, answers)
+
+if __name__ == '__main__':
+    main()
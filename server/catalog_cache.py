@@ -0,0 +1,166 @@
+import os
+from threading import Lock
+from redis import RedisError
+from extensions import cache, redis_client
+from quiz_cache import LRUCache
+
+# Catalog responses are cached under keys that embed the current generation of
+# every tag they depend on (subjects, subject:<id>, chapter:<id>, ...). Admin
+# mutations bump the generations of exactly the tags they touch, so stale
+# entries are never read again and simply expire, with no key scanning.
+#
+# Tags:
+#   subjects        the subject list
+#   subject:<id>    a subject and its chapter list
+#   chapter:<id>    a chapter, its subject summary and its quiz list
+#   chapters        the chapter -> subject map
+#   search          every search result page
+#
+# Each worker process keeps a small LRU of decoded values and of the tag
+# generations it has seen in front of Redis. bump_tags publishes the bumped
+# tags on INVALIDATION_CHANNEL; a listener thread per process forgets its
+# copy of those generations, so the next read fetches the new ones from Redis
+# and the old local entries become unreachable. While the listener is not
+# running the local tier is bypassed, and LOCAL_TTL bounds staleness if a
+# message is lost or a read races an invalidation.
+
+CATALOG_TIMEOUT = 300
+SEARCH_TIMEOUT = 60
+LOCAL_CACHE_SIZE = 512
+LOCAL_TTL = 30
+INVALIDATION_CHANNEL = 'catalog:invalidate'
+
+_local_values = LRUCache(LOCAL_CACHE_SIZE, ttl=LOCAL_TTL)
+_local_generations = LRUCache(LOCAL_CACHE_SIZE, ttl=LOCAL_TTL)
+
+_stats = {
+    'local': {'hits': 0, 'misses': 0},
+    'redis': {'hits': 0, 'misses': 0}
+}
+_stats_lock = Lock()
+
+_listener = None
+_listener_pid = None
+_listener_lock = Lock()
+
+def _tag_key(tag):
+    return f"tag:{tag}"
+
+def _count(tier, outcome):
+    with _stats_lock:
+        _stats[tier][outcome] += 1
+
+def cache_stats():
+    """Return this process's hit/miss counters for the local and Redis tiers"""
+    with _stats_lock:
+        return {tier: dict(counts) for tier, counts in _stats.items()}
+
+def _forget_generations(tags=None):
+    if tags is None:
+        _local_generations.clear()
+    else:
+        for tag in tags:
+            _local_generations.delete(tag)
+
+def _on_invalidate(message):
+    tags = message['data']
+    if isinstance(tags, bytes):
+        tags = tags.decode()
+    _forget_generations(tags.split('\n'))
+
+def _on_listener_error(error, pubsub, thread):
+    # Whatever was published while disconnected is lost, so start over cold
+    global _listener
+    print(f"Catalog invalidation listener stopped: {str(error)}")
+    thread.stop()
+    _listener = None
+    _forget_generations()
+    _local_values.clear()
+
+def _local_tier_enabled():
+    """Start the invalidation listener in this process if needed; True once it is running"""
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid() and _listener.is_alive():
+        return True
+
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid() and _listener.is_alive():
+            return True
+        # Generations seen before a fork or while no listener ran cannot be trusted
+        _forget_generations()
+        _local_values.clear()
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidate})
+            _listener = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=_on_listener_error)
+            _listener_pid = os.getpid()
+        except RedisError as e:
+            print(f"Failed to start catalog invalidation listener: {str(e)}")
+            _listener = None
+            return False
+    return True
+
+def _generations(tags, use_local):
+    if use_local:
+        known = [_local_generations.get(tag) for tag in tags]
+        if None not in known:
+            return known
+
+    values = cache.get_many(*[_tag_key(tag) for tag in tags])
+    generations = [int(value or 0) for value in values]
+    if use_local:
+        for tag, generation in zip(tags, generations):
+            _local_generations.set(tag, generation)
+    return generations
+
+def get_or_set(key, tags, build, timeout=CATALOG_TIMEOUT):
+    """Return the cached value for key at the tags' current generations, building it on a miss"""
+    use_local = _local_tier_enabled()
+    try:
+        generations = _generations(tags, use_local)
+    except RedisError as e:
+        # Without generations no cached copy can be trusted, so serve from the database
+        print(f"Catalog cache unavailable for {key}: {str(e)}")
+        return build()
+    cache_key = key + ''.join(f":{tag}@{generation}" for tag, generation in zip(tags, generations))
+
+    if use_local:
+        value = _local_values.get(cache_key)
+        if value is not None:
+            _count('local', 'hits')
+            return value
+        _count('local', 'misses')
+
+    try:
+        value = cache.get(cache_key)
+    except RedisError as e:
+        print(f"Catalog cache unavailable for {key}: {str(e)}")
+        return build()
+    if value is None:
+        _count('redis', 'misses')
+        value = build()
+        try:
+            cache.set(cache_key, value, timeout=timeout)
+        except RedisError as e:
+            print(f"Failed to cache catalog entry {key}: {str(e)}")
+            return value
+    else:
+        _count('redis', 'hits')
+
+    if use_local:
+        _local_values.set(cache_key, value)
+    return value
+
+def bump_tags(*tags):
+    """Invalidate every cached entry that depends on any of the given tags"""
+    tags = set(tags)
+    try:
+        for tag in tags:
+            cache.cache.inc(_tag_key(tag))
+    except RedisError as e:
+        print(f"Failed to invalidate catalog tags {sorted(tags)}: {str(e)}")
+    _forget_generations(tags)
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, '\n'.join(tags))
+    except RedisError as e:
+        print(f"Failed to broadcast catalog invalidation for {sorted(tags)}: {str(e)}")
@@ -1,15 +1,26 @@
 from datetime import datetime, timedelta
-from collections import defaultdict
-import io
-import csv
-import time
+import os
+import uuid
+from celery import chord
+from celery.signals import worker_ready
 from flask_mail import Message
 from jinja2 import Template
-from sqlalchemy.orm import joinedload
 from app import mail, celery, app
-from models import Role, QuizAttempt, Score, User, Quiz, Chapter
-from sqlalchemy import func, extract
+from models import QuizAttempt, Score, User, Quiz, DailyQuizStats
+from sqlalchemy import extract
 from ai_report_generator import ai_report_generator
+from grading import refresh_attempt_results
+from submissions import drain_stream
+from reports import iter_monthly_reports
+from quiz_cache import warm_quiz
+from exports import (chunk_path, discard_chunks, id_partitions, merge_chunks,
+                     export_scores, export_attempts, score_export_window, advance_watermark,
+                     FORMAT_FILES)
+from export_jobs import job_artifact_path, complete_job, fail_job, bump_data_version
+from artifacts import artifact_path, download_url, purge_artifacts, DOWNLOAD_LINK_TTL
+from rollups import rebuild_rollups
+from admin_stats import refresh_dashboard_snapshots
+from timeseries import forget_time_series
 
 @celery.task(name='celery_worker.send_daily_reminders')
 def send_daily_reminders():
@@ -58,126 +69,60 @@ def send_reminder_email(recipient, name, subject, body):
     except Exception as e:
         print(f"Failed to send email to {recipient}: {str(e)}")
 
+MONTHLY_REPORT_CHUNK_SIZE = 500
+AI_REPORT_BATCH_SIZE = 200
+
 @celery.task(name='celery_worker.send_monthly_reports')
 def send_monthly_reports():
     now = datetime.utcnow()
     first_day_current = now.replace(day=1)
     last_day_prev = first_day_current - timedelta(days=1)
     first_day_prev = last_day_prev.replace(day=1)
-    end_date = first_day_current - timedelta(days=1) 
-    
-    users = User.query.filter_by(role=Role.USER).all() 
-    print(f"Processing {len(users)} students")
-    
-    for user in users:
-        print(f"Processing student: {user.email}")
-
-        # Get user's attempts for previous month
-        attempts = QuizAttempt.query.filter(
-            QuizAttempt.user_id == user.id,
-            QuizAttempt.end_time != None,
-            QuizAttempt.end_time >= first_day_prev,
-            QuizAttempt.end_time < first_day_current
-        ).options(
-            joinedload(QuizAttempt.quiz)
-            .joinedload(Quiz.chapter)
-            .joinedload(Chapter.subject)
-        ).all()
-        
-        if not attempts:
-            print(f"No attempts found for student {user.email}")
-            continue
-            
-        # Generate performance stats
-        subject_stats = defaultdict(lambda: {'correct': 0, 'total': 0, 'quizzes': set()})
-        total_correct = 0
-        total_questions = 0
-        quiz_count = len(attempts)
-        best_score = 0
-        best_quiz = None
-        quiz_history = []
-
-        for attempt in attempts:
-            scores = Score.query.filter_by(attempt_id=attempt.id).all()
-            correct_in_attempt = 0
-            total_in_attempt = 0
-            
-            for score in scores:
-                subject = attempt.quiz.chapter.subject.name
-                subject_stats[subject]['total'] += 1
-                subject_stats[subject]['quizzes'].add(attempt.quiz_id)
-                total_questions += 1
-                total_in_attempt += 1
-                
-                if score.selected_option == score.question.correct_option:
-                    subject_stats[subject]['correct'] += 1
-                    total_correct += 1
-                    correct_in_attempt += 1
-            
-            # Calculate score for this attempt
-            attempt_score = (correct_in_attempt / total_in_attempt) * 100 if total_in_attempt else 0
-            
-            # Track best quiz
-            if attempt_score > best_score:
-                best_score = attempt_score
-                best_quiz = attempt.quiz
-            
-            # Add to quiz history
-            quiz_history.append({
-                'date': attempt.end_time.date(),
-                'quiz_name': f"{attempt.quiz.chapter.subject.name} - {attempt.quiz.chapter.name}",
-                'score': round(attempt_score, 1)
-            })
-        
-        # Calculate average score
-        avg_score = (total_correct / total_questions) * 100 if total_questions else 0
-        
-        # Prepare subject breakdown
-        subject_breakdown = []
-        for subject, stats in subject_stats.items():
-            accuracy = (stats['correct'] / stats['total']) * 100 if stats['total'] else 0
-            subject_breakdown.append({
-                'name': subject,
-                'quizzes_taken': len(stats['quizzes']),
-                'accuracy': round(accuracy, 1),
-                'correct': stats['correct'],
-                'total': stats['total']
-            })
-        
-        # Prepare best quiz info
-        best_quiz_info = None
-        if best_quiz:
-            best_quiz_info = {
-                'name': f"{best_quiz.chapter.subject.name} - {best_quiz.chapter.name}",
-                'score': round(best_score, 1)
-            }
-        
-        # Generate email content
-        html_content = render_html_report(
-            user=user,
-            month=first_day_prev.strftime("%B %Y"),
-            quiz_count=quiz_count,
-            avg_score=round(avg_score, 1),
-            best_quiz=best_quiz_info,
-            subject_breakdown=subject_breakdown,
-            quiz_history=quiz_history
-        )
+    month = first_day_prev.strftime("%B %Y")
 
-        # Send email without charts
-        send_html_email.delay(
-            recipient=user.email,
-            name=user.full_name,
-            subject=f"Quizlytics Monthly Report - {first_day_prev.strftime('%B %Y')}",
-            html_content=html_content
-        )
+    # Reports for every student come from one pass over the month's attempts;
+    # rendering and sending is fanned out in chunks
+    chunk = []
+    students = 0
+    chunks = 0
+    for report in iter_monthly_reports(first_day_prev, first_day_current):
+        chunk.append(report)
+        if len(chunk) >= MONTHLY_REPORT_CHUNK_SIZE:
+            send_monthly_report_chunk.delay(month, chunk)
+            students += len(chunk)
+            chunks += 1
+            chunk = []
+    if chunk:
+        send_monthly_report_chunk.delay(month, chunk)
+        students += len(chunk)
+        chunks += 1
 
-def render_html_report(user, month, quiz_count, avg_score, best_quiz, subject_breakdown, quiz_history):
-    """Render simplified HTML report without charts"""
-    # Sort subject breakdown by accuracy descending
-    subject_breakdown.sort(key=lambda x: x['accuracy'], reverse=True)
-    
-    # HTML template
-    template = Template("""
+    print(f"Queued monthly reports for {students} students in {chunks} chunks")
+    return students
+
+@celery.task(name='celery_worker.send_monthly_report_chunk')
+def send_monthly_report_chunk(month, reports):
+    """Render and email a chunk of monthly reports over one SMTP connection"""
+    sent = 0
+    with mail.connect() as connection:
+        for report in reports:
+            recipient = report['user']['email']
+            try:
+                # Send email without charts
+                connection.send(Message(
+                    subject=f"Quizlytics Monthly Report - {month}",
+                    recipients=[recipient],
+                    html=render_html_report(month=month, **report),
+                    sender=app.config['MAIL_DEFAULT_SENDER']
+                ))
+                sent += 1
+            except Exception as e:
+                print(f"Failed to send monthly report to {recipient}: {str(e)}")
+    print(f"Sent {sent} of {len(reports)} monthly reports")
+    return sent
+
+# Compiled once per worker rather than once per report
+MONTHLY_REPORT_TEMPLATE = Template("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -291,8 +236,13 @@ def render_html_report(user, month, quiz_count, avg_score, best_quiz, subject_br
     </body>
     </html>
     """)
+
+def render_html_report(user, month, quiz_count, avg_score, best_quiz, subject_breakdown, quiz_history):
+    """Render simplified HTML report without charts"""
+    # Sort subject breakdown by accuracy descending
+    subject_breakdown.sort(key=lambda x: x['accuracy'], reverse=True)
     
-    return template.render(
+    return MONTHLY_REPORT_TEMPLATE.render(
         user=user,
         month=month,
         quiz_count=quiz_count,
@@ -311,46 +261,42 @@ def send_ai_enhanced_monthly_reports():
     last_day_prev = first_day_current - timedelta(days=1)
     first_day_prev = last_day_prev.replace(day=1)
     
-    users = User.query.filter_by(role=Role.USER).all()
-    print(f"Processing {len(users)} students for AI-enhanced monthly reports")
+    month = first_day_prev.strftime("%B %Y")
     
-    for user in users:
-        print(f"Processing AI report for student: {user.email}")
-        
-        # Get user performance data for the previous month
-        performance_data = ai_report_generator.get_user_performance_data(
-            user.id, first_day_prev, first_day_current
-        )
-        
-        if not performance_data['quiz_performance']:
-            print(f"No quiz attempts found for student {user.email}")
-            continue
-        
-        # Generate AI-powered report
-        ai_report = ai_report_generator.generate_insightful_report(
-            performance_data, 
-            user.full_name, 
-            first_day_prev.strftime("%B %Y")
-        )
-        
-        # Generate enhanced HTML content with AI insights
-        html_content = render_ai_enhanced_html_report(
-            user=user,
-            month=first_day_prev.strftime("%B %Y"),
-            performance_data=performance_data,
-            ai_insights=ai_report
-        )
+    # Performance data for every student comes from the same single pass over the
+    # month's attempts as the plain monthly reports, read in full up front so the
+    # cursor is not held open while the model calls run
+    students = [(report['user'], ai_report_generator.performance_data_from_report(report))
+                for report in iter_monthly_reports(first_day_prev, first_day_current)]
+    print(f"Processing {len(students)} students for AI-enhanced monthly reports")
 
-        # Send email with AI-enhanced report
-        send_html_email.delay(
-            recipient=user.email,
-            name=user.full_name,
-            subject=f"Quizlytics AI Insights Report - {first_day_prev.strftime('%B %Y')}",
-            html_content=html_content
-        )
-        
-        # Add delay to avoid rate limiting
-        time.sleep(2)
+    # Reports are generated a batch at a time, concurrently within the provider's rate limits
+    batches = [students[start:start + AI_REPORT_BATCH_SIZE] for start in range(0, len(students), AI_REPORT_BATCH_SIZE)]
+    ai_report_batches = ai_report_generator.generate_reports(
+        [(performance_data, user['full_name'], month) for user, performance_data in batch]
+        for batch in batches
+    )
+    sent = 0
+    for batch, ai_reports in zip(batches, ai_report_batches):
+        for (user, performance_data), ai_report in zip(batch, ai_reports):
+            # Generate enhanced HTML content with AI insights
+            html_content = render_ai_enhanced_html_report(
+                user=user,
+                month=month,
+                performance_data=performance_data,
+                ai_insights=ai_report
+            )
+
+            # Send email with AI-enhanced report
+            send_html_email.delay(
+                recipient=user['email'],
+                name=user['full_name'],
+                subject=f"Quizlytics AI Insights Report - {month}",
+                html_content=html_content
+            )
+        sent += len(batch)
+        print(f"Sent AI reports for {len(batch)} students ({sent}/{len(students)} processed)")
+    return len(students)
 
 def render_ai_enhanced_html_report(user, month, performance_data, ai_insights):
     """Render HTML report with AI-powered insights"""
@@ -589,125 +535,226 @@ def send_html_email(recipient, name, subject, html_content):
     except Exception as e:
         print(f"Failed to send HTML email to {recipient}: {str(e)}")
 
-@celery.task(name='celery_worker.export_scores_csv')
-def export_scores_csv(recipient_email):
-    """Export all quiz scores to CSV and email to admin"""
-    try:
-        # Query all scores with related data
-        scores = Score.query.options(
-            joinedload(Score.user),
-            joinedload(Score.quiz).joinedload(Quiz.chapter).joinedload(Chapter.subject),
-            joinedload(Score.question)
-        ).all()
-
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([
-            'User ID', 'Username', 'Email', 'Quiz ID', 'Subject', 
-            'Chapter', 'Question', 'Selected Option', 'Correct Option',
-            'Is Correct', 'Timestamp'
-        ])
-        
-        for score in scores:
-            writer.writerow([
-                score.user.id,
-                score.user.username,
-                score.user.email,
-                score.quiz_id,
-                score.quiz.chapter.subject.name,
-                score.quiz.chapter.name,
-                score.question.question_statement,
-                score.selected_option,
-                score.question.correct_option,
-                score.selected_option == score.question.correct_option,
-                score.timestamp.isoformat()
-            ])
-        
-        csv_content = output.getvalue()
-        output.close()
-
-        # Create email with attachment
+def deliver_export(recipients, job):
+    """Email each recipient a download link to a finished export, as described by its job"""
+    # The file stays in the artifact store; only a signed link goes through SMTP
+    url = download_url(job['path'], job['filename'], job['mimetype'])
+    for recipient in recipients:
         msg = Message(
-            subject="Quizlytics Scores Export",
-            recipients=[recipient_email],
-            body="Please find attached the CSV export of all quiz scores."
+            subject=job['subject'],
+            recipients=[recipient],
+            body=f"{job['body']}\n\nDownload {job['filename']} ({job['rows']} rows):\n{url}\n\n"
+                 f"This link expires in {DOWNLOAD_LINK_TTL // 3600} hours."
         )
-        msg.attach("quiz_scores.csv", "text/csv", csv_content)
-        
         mail.send(msg)
-        print(f"Sent scores CSV to {recipient_email}")
+        if job.get('watermark'):
+            last_id, last_timestamp = job['watermark']
+            advance_watermark(recipient, 'scores', last_id,
+                              datetime.fromisoformat(last_timestamp) if last_timestamp else None)
+    print(f"Sent {job['filename']} ({job['rows']} rows) to {', '.join(recipients)}")
+
+def abandon_export(job_key, error, path=None):
+    """Remove a failed export's partial artifact and drop its shared job, if any, so the next request starts over"""
+    if path and os.path.exists(path):
+        os.remove(path)
+    if job_key:
+        recipients = fail_job(job_key)
+        print(f"Export for {', '.join(recipients)} failed: {error}")
+
+@celery.task(name='celery_worker.send_export')
+def send_export(recipients, job):
+    """Deliver the artifact of an identical export that already finished"""
+    try:
+        deliver_export(recipients, job)
     except Exception as e:
-        print(f"Failed to export scores CSV: {str(e)}")
+        print(f"Failed to send export {job['filename']}: {str(e)}")
 
-@celery.task(name='celery_worker.export_user_performance_csv')
-def export_user_performance_csv(recipient_email, user_id=None):
-    """Export user performance data to CSV"""
+@celery.task(name='celery_worker.export_scores_csv')
+def export_scores_csv(recipient_email, export_format='csv', mode='full', job_key=None):
+    """Export quiz scores as gzip CSV or Parquet and email to admin.
+
+    mode='incremental' sends only the scores added since this recipient's
+    last export; both modes move the recipient's watermark forward. With a
+    job_key the export is a shared job and goes to everyone attached to it.
+    """
+    suffix, mimetype = FORMAT_FILES[export_format]
+    # Shared jobs name their artifact after the job so identical requests can reuse it
+    path = job_artifact_path(job_key, suffix) if job_key else artifact_path(suffix)
+    recipients = None
     try:
-        # Query user performance data
-        if user_id:
-            # Single user export
-            user = User.query.get(user_id)
-            if not user:
-                return
-                
-            filename = f"user_{user_id}_performance.csv"
-            subject = f"Quizlytics Performance Report - {user.username}"
-            
-            # Get all attempts for this user
-            attempts = QuizAttempt.query.filter_by(user_id=user_id).all()
+        after_id, upto_id, upto_timestamp = score_export_window(recipient_email, full=(mode == 'full'))
+
+        # Stream rows into a spool file instead of building the export in memory
+        rows = export_scores(path, export_format, Score.id > after_id, Score.id <= upto_id)
+
+        if mode == 'full':
+            filename = f"quiz_scores{suffix}"
+            body = "Your export of all quiz scores is ready."
         else:
-            # All users export (admin)
-            filename = "all_users_performance.csv"
-            subject = "Quizlytics All Users Performance Report"
-            
-            # Get all attempts
-            attempts = QuizAttempt.query.all()
-        
-        # Create CSV in memory
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow([
-            'User ID', 'Username', 'Email', 'Quiz ID', 'Subject', 
-            'Chapter', 'Start Time', 'End Time', 'Time Spent (s)',
-            'Correct Answers', 'Total Questions', 'Score (%)'
-        ])
-        
-        for attempt in attempts:
-            # Get scores for this attempt
-            scores = Score.query.filter_by(attempt_id=attempt.id).all()
-            total_questions = len(scores)
-            correct_answers = sum(
-                1 for s in scores 
-                if s.selected_option == s.question.correct_option
-            )
-            score_percentage = round((correct_answers / total_questions) * 100) if total_questions else 0
-            
-            writer.writerow([
-                attempt.user_id,
-                attempt.user.username,
-                attempt.user.email,
-                attempt.quiz_id,
-                attempt.quiz.chapter.subject.name,
-                attempt.quiz.chapter.name,
-                attempt.start_time.isoformat(),
-                attempt.end_time.isoformat() if attempt.end_time else '',
-                attempt.time_spent,
-                correct_answers,
-                total_questions,
-                score_percentage
-            ])
-        
-        csv_content = output.getvalue()
-        output.close()
-        msg = Message(
-            subject=subject,
-            recipients=[recipient_email],
-            body="Please find attached the performance data export."
-        )
-        msg.attach(filename, "text/csv", csv_content)
-        
-        mail.send(msg)
-        print(f"Sent performance CSV to {recipient_email}")
+            filename = f"quiz_scores_{after_id + 1}-{upto_id}{suffix}"
+            body = "Your export of the quiz scores added since your last export is ready."
+
+        job = {
+            'path': path, 'rows': rows, 'filename': filename, 'mimetype': mimetype,
+            'subject': "Quizlytics Scores Export", 'body': body,
+            'watermark': [upto_id, upto_timestamp and upto_timestamp.isoformat()] if upto_id > after_id else None
+        }
+        recipients = complete_job(job_key, job) if job_key else [recipient_email]
+        deliver_export(recipients, job)
+    except Exception as e:
+        print(f"Failed to export scores: {str(e)}")
+        if recipients is None:
+            abandon_export(job_key, str(e), path)
+
+@celery.task(name='celery_worker.export_user_performance_csv')
+def export_user_performance_csv(recipient_email, user_id=None, export_format='csv', job_key=None):
+    """Export user performance data as gzip CSV or Parquet"""
+    if not user_id:
+        # All users export (admin): fanned out over attempt id ranges
+        return start_partitioned_performance_export(recipient_email, export_format, job_key)
+
+    suffix, mimetype = FORMAT_FILES[export_format]
+    # Single user export
+    user = User.query.get(user_id)
+    if not user:
+        return
+
+    path = artifact_path(suffix)
+    try:
+        # Results are materialized per attempt; only legacy rows are regraded
+        rows = export_attempts(path, export_format, QuizAttempt.user_id == user_id)
+
+        deliver_export([recipient_email], {
+            'path': path, 'rows': rows,
+            'filename': f"user_{user_id}_performance{suffix}", 'mimetype': mimetype,
+            'subject': f"Quizlytics Performance Report - {user.full_name}",
+            'body': "Your performance data export is ready."
+        })
+    except Exception as e:
+        print(f"Failed to export performance data: {str(e)}")
+        abandon_export(None, str(e), path)
+
+def start_partitioned_performance_export(recipient_email, export_format='csv', job_key=None):
+    """Export every attempt with one task per id range, merged by a chord callback once all finish"""
+    export_id = uuid.uuid4().hex
+    partitions = id_partitions(QuizAttempt.id, app.config['EXPORT_PARTITION_SIZE'])
+    finish = finish_performance_export.s(recipient_email, export_id, export_format, job_key)
+    if not partitions:
+        finish.delay([])
+        return export_id
+
+    chord([
+        export_performance_partition.s(export_id, index, first_id, last_id, export_format)
+        for index, (first_id, last_id) in enumerate(partitions)
+    ])(finish.on_error(discard_performance_export.s(recipient_email, export_id, job_key)))
+    print(f"Started performance export {export_id} in {len(partitions)} partitions")
+    return export_id
+
+@celery.task(name='celery_worker.export_performance_partition')
+def export_performance_partition(export_id, index, first_id, last_id, export_format='csv'):
+    """Write the attempts with ids first_id..last_id to a chunk file; returns (path, rows)"""
+    path = chunk_path(export_id, index, FORMAT_FILES[export_format][0])
+    rows = export_attempts(path, export_format, QuizAttempt.id.between(first_id, last_id), header=False)
+    return path, rows
+
+@celery.task(name='celery_worker.finish_performance_export')
+def finish_performance_export(chunks, recipient_email, export_id, export_format='csv', job_key=None):
+    """Merge the partition chunks in id order and email the export"""
+    suffix, mimetype = FORMAT_FILES[export_format]
+    path = job_artifact_path(job_key, suffix) if job_key else artifact_path(suffix)
+    recipients = None
+    try:
+        merge_chunks(path, export_format, [chunk for chunk, _ in chunks])
+        job = {
+            'path': path, 'rows': sum(count for _, count in chunks),
+            'filename': f"all_users_performance{suffix}", 'mimetype': mimetype,
+            'subject': "Quizlytics All Users Performance Report",
+            'body': "Your export of all users' performance data is ready."
+        }
+        recipients = complete_job(job_key, job) if job_key else [recipient_email]
+        deliver_export(recipients, job)
     except Exception as e:
-        print(f"Failed to export performance CSV: {str(e)}")
\ No newline at end of file
+        print(f"Failed to export performance data: {str(e)}")
+        if recipients is None:
+            abandon_export(job_key, str(e), path)
+    finally:
+        discard_chunks(export_id)
+
+@celery.task(name='celery_worker.discard_performance_export')
+def discard_performance_export(request, exc, traceback, recipient_email, export_id, job_key=None):
+    """Chord error callback: remove the chunks of a failed partitioned export"""
+    print(f"Failed to export performance data {export_id} for {recipient_email}: {str(exc)}")
+    discard_chunks(export_id)
+    abandon_export(job_key, str(exc))
+
+@celery.task(name='celery_worker.purge_export_artifacts')
+def purge_export_artifacts():
+    """Delete export artifacts whose download links have all expired"""
+    removed = purge_artifacts()
+    if removed:
+        print(f"Purged {removed} export artifacts")
+    return removed
+
+@celery.task(name='celery_worker.backfill_attempt_results')
+def backfill_attempt_results():
+    """Materialize correct/total/percentage on completed attempts that predate grading at submit time.
+
+    The columns are added to existing databases by migrations.add_attempt_result_columns.
+    """
+    updated = refresh_attempt_results(QuizAttempt.total_questions.is_(None))
+    print(f"Backfilled results for {updated} quiz attempts")
+    return updated
+
+@celery.task(name='celery_worker.reconcile_daily_stats')
+def reconcile_daily_stats():
+    """Rebuild the daily stats rollups from quiz attempts to pick up regrades and deletions"""
+    rows = rebuild_rollups()
+    forget_time_series('quiz-activity')
+    print(f"Rebuilt {rows} daily stats rows")
+    return rows
+
+@celery.task(name='celery_worker.refresh_quiz_stats')
+def refresh_quiz_stats(quiz_ids, regrade=False):
+    """Regrade the attempts of edited quizzes if asked, then rebuild their daily stats rows"""
+    if regrade:
+        refresh_attempt_results(QuizAttempt.quiz_id.in_(quiz_ids))
+        bump_data_version(['all-performance'])
+    rows = rebuild_rollups(quiz_ids)
+    forget_time_series('quiz-activity')
+    print(f"Rebuilt {rows} daily stats rows for quizzes {quiz_ids}")
+    return rows
+
+@worker_ready.connect
+def bootstrap_daily_stats(sender, **kwargs):
+    """Build the daily stats rollups right away while the table is still empty, instead of at the nightly rebuild"""
+    with app.app_context():
+        if DailyQuizStats.query.first() is None and QuizAttempt.query.first() is not None:
+            celery.send_task('celery_worker.reconcile_daily_stats')
+
+@celery.task(name='celery_worker.refresh_dashboard_stats')
+def refresh_dashboard_stats():
+    """Rebuild the admin dashboard snapshot for every period the analytics page offers"""
+    return list(refresh_dashboard_snapshots())
+
+@celery.task(name='celery_worker.drain_submission_stream')
+def drain_submission_stream():
+    """Write queued quiz submissions to the database in batches"""
+    drained = drain_stream()
+    if drained:
+        print(f"Persisted {drained} queued quiz submissions")
+    return drained
+
+@celery.task(name='celery_worker.prewarm_upcoming_quizzes')
+def prewarm_upcoming_quizzes():
+    """Cache question payloads, answer keys and quiz windows for quizzes about to open"""
+    now = datetime.utcnow()
+    horizon = now + timedelta(minutes=app.config['QUIZ_PREWARM_MINUTES'])
+    upcoming = Quiz.query.with_entities(Quiz.id).filter(
+        Quiz.start_time >= now,
+        Quiz.start_time <= horizon
+    ).all()
+
+    warmed = [quiz_id for (quiz_id,) in upcoming if warm_quiz(quiz_id)]
+    if warmed:
+        print(f"Pre-warmed caches for quizzes {warmed}")
+    return warmed
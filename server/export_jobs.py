@@ -0,0 +1,109 @@
+import hashlib
+import json
+from redis import RedisError
+from sqlalchemy import func
+from extensions import redis_client
+from models import db, Score, QuizAttempt
+import artifacts
+
+# Admin exports are shared jobs keyed by (export type, format, data version).
+# The first request starts the job; identical requests while it runs only add
+# their recipient, and requests after it finished reuse its artifact for as
+# long as the data version stays the same. The job record is a Redis string:
+# {"state": "running"} while in flight (expiring after JOB_TIMEOUT so a dead
+# worker does not block new jobs), then the finished job described by the
+# worker, kept for ARTIFACT_TTL. Waiting recipients are a Redis set that
+# complete_job / fail_job empty atomically with the state change.
+#
+# The data version is the newest primary keys (index lookups, no scans) plus
+# a Redis generation per export type that bump_data_version increments when
+# rows change in place: regrades and deletions.
+
+JOB_TIMEOUT = 60 * 60
+EXPORT_TYPES = ('scores', 'all-performance')
+# Versions only track rows, so renames show up once the artifact ages out
+ARTIFACT_TTL = artifacts.REUSE_WINDOW
+
+def _generation_key(export_type):
+    return f"export:generation:{export_type}"
+
+def data_version(export_type):
+    """A value that changes whenever the rows of the export change; raises RedisError"""
+    if export_type == 'scores':
+        columns = (func.max(Score.id),)
+    else:
+        # Submitting an attempt adds its Score rows
+        columns = (func.max(QuizAttempt.id), func.max(Score.id))
+    ids = db.session.query(*columns).one()
+    generation = redis_client.get(_generation_key(export_type))
+    return '-'.join(str(value or 0) for value in (*ids, int(generation or 0)))
+
+def bump_data_version(export_types=EXPORT_TYPES):
+    """Mark the exports as changed after their rows were regraded or deleted"""
+    try:
+        pipe = redis_client.pipeline()
+        for export_type in export_types:
+            pipe.incr(_generation_key(export_type))
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to bump export data version for {export_types}: {str(e)}")
+
+def _job_key(export_type, export_format):
+    return f"export:job:{export_type}:{export_format}:{data_version(export_type)}"
+
+def _recipients_key(job_key):
+    return f"{job_key}:recipients"
+
+def job_artifact_path(job_key, suffix):
+    """Where the job's export is written in the artifact store"""
+    return artifacts.artifact_path(suffix, hashlib.sha1(job_key.encode()).hexdigest()[:20])
+
+def request_export(export_type, export_format, recipient_email):
+    """Attach a recipient to the export of the current data. Returns (action, job key, job):
+
+    'start'    - no job yet; the caller enqueues one with the job key
+    'attached' - a job is running and will deliver to the recipient
+    'ready'    - the finished job's artifact can be delivered right away
+    With Redis unavailable the action is 'start' with no job key.
+    """
+    try:
+        key = _job_key(export_type, export_format)
+        recipients_key = _recipients_key(key)
+        job = json.loads(redis_client.get(key) or 'null')
+        if job and job['state'] == 'done':
+            return 'ready', key, job
+
+        pipe = redis_client.pipeline()
+        pipe.sadd(recipients_key, recipient_email)
+        pipe.expire(recipients_key, JOB_TIMEOUT)
+        pipe.execute()
+        if redis_client.set(key, json.dumps({'state': 'running'}), nx=True, ex=JOB_TIMEOUT):
+            return 'start', key, None
+
+        # The job may have finished since; if it has not taken the recipient, deliver directly
+        job = json.loads(redis_client.get(key) or 'null')
+        if job and job['state'] == 'done' and redis_client.srem(recipients_key, recipient_email):
+            return 'ready', key, job
+        return 'attached', key, job
+    except RedisError as e:
+        print(f"Export jobs unavailable, exporting without coalescing: {str(e)}")
+        return 'start', None, None
+
+def _finish_job(job_key, job):
+    pipe = redis_client.pipeline()
+    if job is None:
+        pipe.delete(job_key)
+    else:
+        pipe.set(job_key, json.dumps({**job, 'state': 'done'}), ex=ARTIFACT_TTL)
+    pipe.smembers(_recipients_key(job_key))
+    pipe.delete(_recipients_key(job_key))
+    _, recipients, _ = pipe.execute()
+    return sorted(recipient.decode() for recipient in recipients)
+
+def complete_job(job_key, job):
+    """Publish the finished job (a JSON-serializable dict) and return the recipients waiting for it"""
+    return _finish_job(job_key, job)
+
+def fail_job(job_key):
+    """Forget a failed job so the next request starts over; returns the recipients that were waiting"""
+    return _finish_job(job_key, None)
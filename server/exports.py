@@ -0,0 +1,296 @@
+import csv
+import glob
+import gzip
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, func, case, Boolean, DateTime
+from sqlalchemy.dialects import postgresql
+from models import db, Score, User, Quiz, Chapter, Subject, Question, QuizAttempt, ExportWatermark
+from grading import results_for_rows, percentage
+
+# Exports stream column projections straight from the database into a spool
+# file, so memory stays constant however many rows the table holds. Rows are
+# fetched EXPORT_BATCH_SIZE at a time through a server-side cursor
+# (yield_per) and written either as gzip-compressed CSV or as Parquet with
+# typed, dictionary-encoded columns. A plain CSV on PostgreSQL with psycopg2
+# is produced by COPY ... TO STDOUT instead, with booleans and timestamps
+# rendered in SQL exactly as the Python writer renders them.
+#
+# Large exports are split into QuizAttempt id ranges (id_partitions) that
+# workers write as separate chunk files in EXPORT_SPOOL_DIR, which must be
+# shared by every worker; merge_chunks then joins them in id order.
+
+EXPORT_BATCH_SIZE = 5000
+PARQUET_ROW_GROUP_SIZE = 100000
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_MODES = ('full', 'incremental')
+# Incremental exports leave out scores newer than this, so a transaction that
+# took a lower id but commits late is not skipped by the watermark. Score
+# timestamps are write times: queued submissions are stamped when drained.
+WATERMARK_SETTLE_DELAY = timedelta(minutes=5)
+
+# (filename suffix, MIME type) per format
+FORMAT_FILES = {
+    'csv': ('.csv.gz', 'application/gzip'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet')
+}
+
+SCORE_HEADER = [
+    'User ID', 'Full Name', 'Email', 'Quiz ID', 'Subject',
+    'Chapter', 'Question', 'Selected Option', 'Correct Option',
+    'Is Correct', 'Timestamp'
+]
+
+ATTEMPT_HEADER = [
+    'User ID', 'Full Name', 'Email', 'Quiz ID', 'Subject',
+    'Chapter', 'Start Time', 'End Time', 'Time Spent (s)',
+    'Correct Answers', 'Total Questions', 'Score (%)'
+]
+
+def _pyarrow():
+    # pyarrow is only needed for Parquet exports, so it is imported on first use
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet exports require pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+def _score_schema(pa):
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('user_id', pa.int64()), ('full_name', pa.string()), ('email', pa.string()),
+        ('quiz_id', pa.int64()), ('subject', category), ('chapter', category),
+        ('question', pa.string()), ('selected_option', pa.int8()), ('correct_option', pa.int8()),
+        ('is_correct', pa.bool_()), ('timestamp', pa.timestamp('us'))
+    ])
+
+def _attempt_schema(pa):
+    category = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('user_id', pa.int64()), ('full_name', pa.string()), ('email', pa.string()),
+        ('quiz_id', pa.int64()), ('subject', category), ('chapter', category),
+        ('start_time', pa.timestamp('us')), ('end_time', pa.timestamp('us')), ('time_spent', pa.int64()),
+        ('correct_answers', pa.int32()), ('total_questions', pa.int32()), ('score_percentage', pa.float64())
+    ])
+
+def score_export_query(*criteria):
+    """One row per Score, joined to its user, quiz, chapter, subject and question"""
+    return select(
+        User.id, User.full_name, User.email, Score.quiz_id,
+        Subject.name, Chapter.name, Question.question_statement,
+        Score.selected_option, Question.correct_option,
+        # An unanswered question compares as NULL
+        func.coalesce(Score.selected_option == Question.correct_option, False),
+        Score.timestamp
+    ).select_from(Score) \
+        .join(User, Score.user_id == User.id) \
+        .join(Quiz, Score.quiz_id == Quiz.id) \
+        .join(Chapter, Quiz.chapter_id == Chapter.id) \
+        .join(Subject, Chapter.subject_id == Subject.id) \
+        .join(Question, Score.question_id == Question.id) \
+        .where(*criteria) \
+        .order_by(Score.id)
+
+def attempt_export_query(*criteria):
+    """One row per QuizAttempt with its materialized result and the id used for regrading"""
+    return select(
+        QuizAttempt.user_id, User.full_name, User.email, QuizAttempt.quiz_id,
+        Subject.name, Chapter.name, QuizAttempt.start_time, QuizAttempt.end_time,
+        QuizAttempt.time_spent, QuizAttempt.correct_count, QuizAttempt.total_questions,
+        QuizAttempt.id
+    ).select_from(QuizAttempt) \
+        .join(User, QuizAttempt.user_id == User.id) \
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id) \
+        .join(Chapter, Quiz.chapter_id == Chapter.id) \
+        .join(Subject, Chapter.subject_id == Subject.id) \
+        .where(*criteria) \
+        .order_by(QuizAttempt.id)
+
+def _attempt_rows(batch):
+    # Everything up to time_spent as selected, then the results and the percentage
+    return [(*row[:9], correct, total, percentage(correct, total, 2))
+            for row, correct, total in results_for_rows(batch)]
+
+def spool_dir():
+    # None lets tempfile pick the system temp directory
+    return current_app.config.get('EXPORT_SPOOL_DIR')
+
+def spool_path(suffix):
+    fd, path = tempfile.mkstemp(prefix='export-', suffix=suffix, dir=spool_dir())
+    os.close(fd)
+    return path
+
+def _chunk_prefix(export_id):
+    return os.path.join(spool_dir() or tempfile.gettempdir(), f"export-{export_id}-")
+
+def chunk_path(export_id, index, suffix):
+    """Path of one partition's chunk file, known to every worker from the export id"""
+    return f"{_chunk_prefix(export_id)}{index:05d}{suffix}"
+
+def discard_chunks(export_id):
+    for path in glob.glob(glob.escape(_chunk_prefix(export_id)) + '*'):
+        os.remove(path)
+
+def id_partitions(column, size, *criteria):
+    """Split the ids of rows matching the criteria into [(first, last)] ranges of at most size ids"""
+    low, high = db.session.query(func.min(column), func.max(column)).filter(*criteria).one()
+    if low is None:
+        return []
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+def _format(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def iter_batches(stmt, transform=None, batch_size=EXPORT_BATCH_SIZE):
+    """Yield lists of rows batch_size at a time from a server-side cursor"""
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for partition in result.partitions():
+        yield transform(partition) if transform else partition
+
+def _copy_cursor():
+    """Return a psycopg2 cursor when COPY is available on the current connection"""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return None
+    cursor = db.session.connection().connection.cursor()
+    if not hasattr(cursor, 'copy_expert'):
+        cursor.close()
+        return None
+    return cursor
+
+def _copy_column(column):
+    # Render values the way the csv module path does: True/False and isoformat()
+    if isinstance(column.type, Boolean):
+        return case((column, 'True'), (~column, 'False'))
+    if isinstance(column.type, DateTime):
+        return case(
+            (func.to_char(column, 'US') == '000000', func.to_char(column, 'YYYY-MM-DD"T"HH24:MI:SS')),
+            else_=func.to_char(column, 'YYYY-MM-DD"T"HH24:MI:SS.US')
+        )
+    return column
+
+def write_csv_gz(path, header, stmt, transform=None):
+    """Write the header (unless None) and every row of stmt to a gzip CSV at path; returns the row count"""
+    cursor = _copy_cursor() if transform is None else None
+    if cursor is not None:
+        stmt = stmt.with_only_columns(*[_copy_column(column) for column in stmt.selected_columns])
+        sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True})
+        with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+            if header is not None:
+                # COPY ends lines with \n
+                csv.writer(f, lineterminator='\n').writerow(header)
+        # Append a second gzip member; readers see one continuous stream
+        with gzip.open(path, 'ab') as f, cursor:
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", f)
+            return cursor.rowcount
+
+    count = 0
+    with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        if header is not None:
+            writer.writerow(header)
+        for batch in iter_batches(stmt, transform):
+            writer.writerows([_format(value) for value in row] for row in batch)
+            count += len(batch)
+    return count
+
+def write_parquet(path, schema, stmt, transform=None):
+    """Write every row of stmt to a Parquet file at path in row groups; returns the row count"""
+    pa, pq = _pyarrow()
+
+    def flush(writer, rows):
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ), row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+        pending = []
+        for batch in iter_batches(stmt, transform):
+            pending.extend(batch)
+            if len(pending) >= PARQUET_ROW_GROUP_SIZE:
+                flush(writer, pending)
+                count += len(pending)
+                pending = []
+        if pending:
+            flush(writer, pending)
+            count += len(pending)
+    return count
+
+def export_scores(path, export_format='csv', *criteria):
+    """Stream every Score matching the criteria to path; returns the row count"""
+    stmt = score_export_query(*criteria)
+    if export_format == 'parquet':
+        return write_parquet(path, _score_schema(_pyarrow()[0]), stmt)
+    return write_csv_gz(path, SCORE_HEADER, stmt)
+
+def export_attempts(path, export_format='csv', *criteria, header=True):
+    """Stream every QuizAttempt matching the criteria to path; returns the row count.
+
+    With header=False a CSV is written without its header row, for chunks.
+    """
+    stmt = attempt_export_query(*criteria)
+    if export_format == 'parquet':
+        return write_parquet(path, _attempt_schema(_pyarrow()[0]), stmt, _attempt_rows)
+    return write_csv_gz(path, ATTEMPT_HEADER if header else None, stmt, _attempt_rows)
+
+def score_export_window(recipient_email, export_name='scores', full=False):
+    """Return (after_id, upto_id, upto_timestamp): the Score ids the next export covers.
+
+    An incremental export covers ids above the recipient's watermark, a full
+    snapshot every id. Either way it stops at the newest settled score.
+    Deleted scores only disappear from the warehouse with a full snapshot.
+    """
+    upto_id, upto_timestamp = db.session.query(func.max(Score.id), func.max(Score.timestamp)) \
+        .filter(Score.timestamp < datetime.utcnow() - WATERMARK_SETTLE_DELAY) \
+        .one()
+    after_id = 0
+    if not full:
+        after_id = db.session.query(ExportWatermark.last_id).filter_by(
+            recipient_email=recipient_email, export_name=export_name
+        ).scalar() or 0
+    return after_id, max(upto_id or 0, after_id), upto_timestamp
+
+def advance_watermark(recipient_email, export_name, last_id, last_timestamp=None):
+    """Record that everything up to last_id reached the recipient; call once the export was delivered"""
+    watermark = ExportWatermark.query.filter_by(recipient_email=recipient_email, export_name=export_name).first()
+    if watermark is None:
+        watermark = ExportWatermark(recipient_email=recipient_email, export_name=export_name)
+        db.session.add(watermark)
+    watermark.last_id = last_id
+    watermark.last_timestamp = last_timestamp
+    db.session.commit()
+
+def merge_chunks(path, export_format, chunk_paths, header=ATTEMPT_HEADER):
+    """Join chunk files written with header=False, in the given order, into one export at path"""
+    if export_format == 'parquet':
+        pa, pq = _pyarrow()
+        schema = _attempt_schema(pa)
+        with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+            pending, pending_rows = [], 0
+            for chunk in chunk_paths:
+                # One row group in memory at a time, re-packed to full row groups
+                chunk_file = pq.ParquetFile(chunk)
+                for index in range(chunk_file.num_row_groups):
+                    table = chunk_file.read_row_group(index)
+                    pending.append(table)
+                    pending_rows += table.num_rows
+                    if pending_rows >= PARQUET_ROW_GROUP_SIZE:
+                        writer.write_table(pa.concat_tables(pending), row_group_size=PARQUET_ROW_GROUP_SIZE)
+                        pending, pending_rows = [], 0
+            if pending:
+                writer.write_table(pa.concat_tables(pending), row_group_size=PARQUET_ROW_GROUP_SIZE)
+        return
+
+    # Concatenated gzip members decompress as one stream, so chunks are copied as they are
+    with gzip.open(path, 'wt', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(header)
+    with open(path, 'ab') as out:
+        for chunk in chunk_paths:
+            with open(chunk, 'rb') as f:
+                shutil.copyfileobj(f, out)
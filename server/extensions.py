@@ -2,9 +2,12 @@ from flask_caching import Cache
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import os
+import redis
 
 cache = Cache()
 
+redis_client = redis.Redis.from_url(os.getenv('REDIS_URL', 'redis://localhost:6380/0'))
+
 limiter = Limiter(
     key_func=get_remote_address,
     storage_uri=os.getenv('REDIS_URL', 'redis://localhost:6380/0')
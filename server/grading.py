@@ -0,0 +1,180 @@
+from sqlalchemy import func, case
+from models import db, Score, Question, QuizAttempt, Quiz, Chapter
+
+# Shared grading queries. Results are materialized on QuizAttempt when an
+# attempt is submitted (correct_count / total_questions / score_percentage);
+# aggregate statistics are read from the daily rollups (rollups.py) built
+# from those columns. Regrading from Score rows is done with one grouped join
+# of score -> question and is only needed for backfilling historical attempts
+# or after an admin edits a question.
+
+REFRESH_BATCH_SIZE = 1000
+# Lower edges (in percent) of the admin score distribution buckets above the first
+DISTRIBUTION_EDGES = (60, 75, 90)
+
+def percentage(correct, total, ndigits=None):
+    if not total:
+        return 0
+    return round((correct / total) * 100, ndigits)
+
+def clean_answers(answers):
+    """Return submitted answers as {question id: option number or None}; raises ValueError if malformed"""
+    if not isinstance(answers, dict):
+        raise ValueError("answers must map question ids to options")
+    cleaned = {}
+    for question_id, selected in answers.items():
+        if selected is not None:
+            if isinstance(selected, bool):
+                raise ValueError(f"Invalid option for question {question_id}")
+            try:
+                selected = int(selected)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid option for question {question_id}")
+            if not 1 <= selected <= 4:
+                raise ValueError(f"Invalid option for question {question_id}")
+        cleaned[str(question_id)] = selected
+    return cleaned
+
+def grade_answers(answer_key, answers):
+    """Return (correct, total) for submitted answers against [(question_id, correct_option)]"""
+    correct = 0
+    for question_id, correct_option in answer_key:
+        selected = answers.get(str(question_id))
+        if selected is not None and int(selected) == correct_option:
+            correct += 1
+    return correct, len(answer_key)
+
+def finalize_attempt(attempt, correct, total):
+    attempt.correct_count = correct
+    attempt.total_questions = total
+    attempt.score_percentage = (correct / total) * 100 if total else 0
+
+def grade_attempts(*criteria, attempt_ids=None):
+    """Regrade from Score rows, returning {attempt_id: (correct, total)}"""
+    if attempt_ids is not None:
+        attempt_ids = list(attempt_ids)
+        if not attempt_ids:
+            return {}
+        criteria = criteria + (Score.attempt_id.in_(attempt_ids),)
+
+    correct = func.coalesce(func.sum(
+        case((Score.selected_option == Question.correct_option, 1), else_=0)
+    ), 0)
+    rows = db.session.query(Score.attempt_id, correct, func.count(Score.id)) \
+        .select_from(Score) \
+        .join(Question, Score.question_id == Question.id) \
+        .join(QuizAttempt, Score.attempt_id == QuizAttempt.id) \
+        .filter(*criteria) \
+        .group_by(Score.attempt_id) \
+        .all()
+    return {attempt_id: (int(correct), int(total)) for attempt_id, correct, total in rows}
+
+def attempt_results(attempts):
+    """Return {attempt_id: (correct, total)}, regrading only attempts not yet materialized"""
+    results = {}
+    ungraded = []
+    for attempt in attempts:
+        if attempt.total_questions is not None:
+            results[attempt.id] = (attempt.correct_count, attempt.total_questions)
+        else:
+            ungraded.append(attempt.id)
+    if ungraded:
+        results.update(grade_attempts(attempt_ids=ungraded))
+    return results
+
+def results_for_rows(rows):
+    """Return [(row, correct, total)] for query rows with id, end_time, correct_count and total_questions.
+
+    Materialized results are used as stored; completed attempts that predate
+    them are regraded together in one query. Unfinished attempts count as 0/0.
+    """
+    grades = grade_attempts(attempt_ids=[
+        row.id for row in rows if row.total_questions is None and row.end_time is not None
+    ])
+    return [
+        (row, row.correct_count, row.total_questions) if row.total_questions is not None
+        else (row, *grades.get(row.id, (0, 0)))
+        for row in rows
+    ]
+
+def parse_edges(value):
+    """Parse comma-separated bucket edges such as '60,75,90'; raises ValueError"""
+    edges = tuple(float(edge) for edge in value.split(','))
+    if any(lower >= upper for lower, upper in zip(edges, edges[1:])):
+        raise ValueError("edges must be strictly increasing")
+    if edges[0] <= 0 or edges[-1] > 100:
+        raise ValueError("edges must lie in (0, 100]")
+    return edges
+
+def score_histogram(edges, *criteria):
+    """Count graded attempts per score bucket in the database.
+
+    edges are the increasing lower bounds of every bucket but the first, so
+    (60, 75, 90) yields the counts for [0, 60), [60, 75), [75, 90) and
+    [90, 100], lowest bucket first. Criteria may use Quiz and Chapter columns.
+    """
+    bucket = case(
+        *[(QuizAttempt.score_percentage >= edge, index) for index, edge in reversed(list(enumerate(edges, 1)))],
+        else_=0
+    )
+    rows = db.session.query(bucket, func.count(QuizAttempt.id)) \
+        .select_from(QuizAttempt) \
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id) \
+        .join(Chapter, Quiz.chapter_id == Chapter.id) \
+        .filter(QuizAttempt.total_questions > 0, *criteria) \
+        .group_by(bucket) \
+        .all()
+
+    counts = [0] * (len(edges) + 1)
+    for index, count in rows:
+        counts[index] = count
+    return counts
+
+def histogram_labels(edges):
+    bounds = [0, *edges, 100]
+    return [f"{lower:g}-{upper:g}" for lower, upper in zip(bounds, bounds[1:])]
+
+def question_counts(quiz_ids):
+    """Return {quiz_id: number of questions} in one grouped query"""
+    quiz_ids = list(quiz_ids)
+    if not quiz_ids:
+        return {}
+    rows = db.session.query(Question.quiz_id, func.count(Question.id)) \
+        .filter(Question.quiz_id.in_(quiz_ids)) \
+        .group_by(Question.quiz_id) \
+        .all()
+    return dict(rows)
+
+def refresh_attempt_results(*criteria, batch_size=REFRESH_BATCH_SIZE):
+    """Regrade completed attempts matching the criteria and store the results.
+
+    Works in id-ordered batches so a backfill over the whole table never holds
+    more than batch_size attempts in memory. Returns the number of attempts updated.
+    """
+    updated = 0
+    last_id = 0
+    while True:
+        attempt_ids = [row[0] for row in db.session.query(QuizAttempt.id).filter(
+            QuizAttempt.end_time.isnot(None),
+            QuizAttempt.id > last_id,
+            *criteria
+        ).order_by(QuizAttempt.id).limit(batch_size).all()]
+        if not attempt_ids:
+            break
+
+        grades = grade_attempts(attempt_ids=attempt_ids)
+        mappings = []
+        for attempt_id in attempt_ids:
+            correct, total = grades.get(attempt_id, (0, 0))
+            mappings.append({
+                'id': attempt_id,
+                'correct_count': correct,
+                'total_questions': total,
+                'score_percentage': (correct / total) * 100 if total else 0
+            })
+        db.session.bulk_update_mappings(QuizAttempt, mappings)
+        db.session.commit()
+
+        updated += len(attempt_ids)
+        last_id = attempt_ids[-1]
+    return updated
@@ -0,0 +1,112 @@
+from sqlalchemy import inspect, text, func
+from models import db, QuizAttempt, Score
+from attempt_state import forget_attempt_state
+from rollups import rebuild_rollups
+
+# The schema is created by db.create_all(), which adds missing tables but
+# never changes a table that already exists. Changes to existing tables are
+# applied here. Every step checks the live schema first, so upgrade() is safe
+# to run on every deploy and on a fresh database:
+#
+#     python migrations.py
+
+ATTEMPT_RESULT_COLUMNS = ('correct_count', 'total_questions', 'score_percentage')
+ATTEMPT_UNIQUE_COLUMNS = ['user_id', 'quiz_id']
+ATTEMPT_UNIQUE_NAME = 'uq_quiz_attempt_user_quiz'
+
+def _column_names(table):
+    return {column['name'] for column in inspect(db.engine).get_columns(table)}
+
+def add_attempt_result_columns():
+    """Add the materialized result columns to quiz_attempt; returns the columns added.
+
+    Existing attempts are left NULL for the backfill_attempt_results task to regrade.
+    """
+    table = QuizAttempt.__table__
+    existing = _column_names(table.name)
+    missing = [name for name in ATTEMPT_RESULT_COLUMNS if name not in existing]
+    for name in missing:
+        column_type = table.c[name].type.compile(dialect=db.engine.dialect)
+        db.session.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+    db.session.commit()
+    return missing
+
+def _has_unique(table, columns):
+    inspector = inspect(db.engine)
+    uniques = inspector.get_unique_constraints(table) + [
+        index for index in inspector.get_indexes(table) if index['unique']
+    ]
+    return any(sorted(unique['column_names']) == sorted(columns) for unique in uniques)
+
+def merge_duplicate_attempts():
+    """Keep one attempt per (user, quiz): the first completed one, else the oldest.
+
+    Scores of the dropped attempts move to the kept one for questions it has
+    no score for, and are deleted otherwise. Kept attempts that received
+    scores lose their materialized results so the backfill regrades them.
+    Leaves the transaction open; returns the merged [(user_id, quiz_id)].
+    """
+    duplicates = db.session.query(QuizAttempt.user_id, QuizAttempt.quiz_id) \
+        .group_by(QuizAttempt.user_id, QuizAttempt.quiz_id) \
+        .having(func.count(QuizAttempt.id) > 1) \
+        .all()
+
+    for user_id, quiz_id in duplicates:
+        keep, *drop = [attempt_id for (attempt_id,) in db.session.query(QuizAttempt.id).filter_by(
+            user_id=user_id, quiz_id=quiz_id
+        ).order_by(QuizAttempt.end_time.is_(None), QuizAttempt.id)]
+
+        for attempt_id in drop:
+            scored = db.session.query(Score.question_id).filter(Score.attempt_id == keep)
+            moved = Score.query.filter(Score.attempt_id == attempt_id, Score.question_id.notin_(scored)) \
+                .update({Score.attempt_id: keep}, synchronize_session=False)
+            Score.query.filter(Score.attempt_id == attempt_id).delete(synchronize_session=False)
+            if moved:
+                QuizAttempt.query.filter_by(id=keep).update({
+                    QuizAttempt.correct_count: None,
+                    QuizAttempt.total_questions: None,
+                    QuizAttempt.score_percentage: None
+                }, synchronize_session=False)
+        QuizAttempt.query.filter(QuizAttempt.id.in_(drop)).delete(synchronize_session=False)
+    return duplicates
+
+def add_attempt_unique_constraint():
+    """Merge duplicate attempts and add the (user_id, quiz_id) constraint StartQuiz upserts on.
+
+    Returns the number of (user, quiz) pairs merged, or None if the constraint already existed.
+    """
+    table = QuizAttempt.__table__.name
+    if _has_unique(table, ATTEMPT_UNIQUE_COLUMNS):
+        return None
+
+    columns = ', '.join(ATTEMPT_UNIQUE_COLUMNS)
+    if db.engine.dialect.name == 'sqlite':
+        duplicates = merge_duplicate_attempts()
+        # SQLite cannot add constraints to a table; a unique index serves ON CONFLICT the same way
+        db.session.execute(text(f"CREATE UNIQUE INDEX {ATTEMPT_UNIQUE_NAME} ON {table} ({columns})"))
+    else:
+        # Block new attempts until the constraint is in place, so none can slip in after the merge
+        db.session.execute(text(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE"))
+        duplicates = merge_duplicate_attempts()
+        db.session.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {ATTEMPT_UNIQUE_NAME} UNIQUE ({columns})"))
+    db.session.commit()
+
+    for user_id, quiz_id in duplicates:
+        forget_attempt_state(user_id, quiz_id)
+    rebuild_rollups({quiz_id for _, quiz_id in duplicates})
+    return len(duplicates)
+
+def upgrade():
+    """Create missing tables, then bring existing ones up to the models"""
+    db.create_all()
+    added = add_attempt_result_columns()
+    if added:
+        print(f"Added quiz_attempt columns: {', '.join(added)}")
+    merged = add_attempt_unique_constraint()
+    if merged is not None:
+        print(f"Added {ATTEMPT_UNIQUE_NAME} after merging duplicate attempts of {merged} user/quiz pairs")
+
+if __name__ == "__main__":
+    from app import app
+    with app.app_context():
+        upgrade()
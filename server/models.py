@@ -86,12 +86,51 @@ class Score(db.Model):
     attempt_id = db.Column(db.Integer, db.ForeignKey('quiz_attempt.id', ondelete='CASCADE'))
 
 class QuizAttempt(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'quiz_id', name='uq_quiz_attempt_user_quiz'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, default=datetime.utcnow)
     end_time = db.Column(db.DateTime)
     time_spent = db.Column(db.Integer)
+    # Materialized when the attempt is submitted so readers never regrade Score rows
+    correct_count = db.Column(db.Integer)
+    total_questions = db.Column(db.Integer)
+    score_percentage = db.Column(db.Float)
     # This relationship already creates the backref 'quiz' - remove the duplicate in Quiz model
     user = db.relationship('User', backref='quiz_attempts')
-    quiz = db.relationship('Quiz', backref='quiz_attempts')
\ No newline at end of file
+    quiz = db.relationship('Quiz', backref='quiz_attempts')
+
+class DailyQuizStats(db.Model):
+    # Per IST day x quiz x user role rollup of attempt activity. Kept current by
+    # StartQuiz / SubmitQuiz and rebuilt nightly from QuizAttempt (see rollups.py).
+    __table_args__ = (
+        db.UniqueConstraint('day', 'quiz_id', 'user_role', name='uq_daily_quiz_stats_day_quiz_role'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='CASCADE'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', ondelete='CASCADE'), nullable=False)
+    user_role = db.Column(db.Enum(Role), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    completions = db.Column(db.Integer, nullable=False, default=0)
+    correct_count = db.Column(db.Integer, nullable=False, default=0)
+    total_questions = db.Column(db.Integer, nullable=False, default=0)
+    time_spent = db.Column(db.Integer, nullable=False, default=0)
+    # Distinct users who started or submitted the quiz that day
+    active_users = db.Column(db.Integer, nullable=False, default=0)
+
+class ExportWatermark(db.Model):
+    # Highest Score id already sent by an incremental export, per recipient and export
+    __table_args__ = (
+        db.UniqueConstraint('recipient_email', 'export_name', name='uq_export_watermark_recipient_export'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    recipient_email = db.Column(db.String(100), nullable=False)
+    export_name = db.Column(db.String(50), nullable=False)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    last_timestamp = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,234 @@
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from flask import current_app
+import pytz
+from redis import RedisError
+from sqlalchemy.orm import joinedload, selectinload
+from extensions import redis_client
+from models import db, Question, Quiz, Chapter
+
+# Per-quiz data that every candidate needs at the same moment (answer key,
+# question payload, quiz window) is cached per process and in Redis, keyed by
+# quiz id and a content version kept in Redis. Admin mutations bump the
+# version, which makes every worker's cached copy unreachable without having
+# to broadcast anything. Versions start at the current time in milliseconds,
+# so after Redis loses the counters no version is handed out twice and the
+# per-process copies of the old content are never read again. warm_quiz fills
+# the Redis tier ahead of start_time.
+
+LOCAL_CACHE_SIZE = 256
+# Old versions are never read again, so Redis copies only need to outlive a quiz window
+PAYLOAD_TTL = 6 * 60 * 60
+
+class LRUCache:
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            expires_at, value = self._data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+_answer_keys = LRUCache()
+_question_payloads = LRUCache()
+_quiz_meta = LRUCache()
+
+def _version_key(quiz_id):
+    return f"quiz:{quiz_id}:version"
+
+def _initial_version():
+    return int(time.time() * 1000)
+
+def content_version(quiz_id):
+    """Return the quiz's content version, or None when Redis is unreachable"""
+    key = _version_key(quiz_id)
+    try:
+        version = redis_client.get(key)
+        if version is None:
+            redis_client.set(key, _initial_version(), nx=True)
+            version = redis_client.get(key)
+    except RedisError:
+        return None
+    return int(version)
+
+def invalidate_quiz(quiz_id):
+    """Bump the quiz's content version after its questions or settings change"""
+    invalidate_quizzes([quiz_id])
+
+def invalidate_quizzes(quiz_ids):
+    quiz_ids = list(quiz_ids)
+    if not quiz_ids:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        for quiz_id in quiz_ids:
+            pipe.set(_version_key(quiz_id), _initial_version(), nx=True)
+            pipe.incr(_version_key(quiz_id))
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to invalidate cache for quizzes {quiz_ids}: {str(e)}")
+
+def load_answer_key(quiz_id):
+    rows = db.session.query(Question.id, Question.correct_option) \
+        .filter(Question.quiz_id == quiz_id) \
+        .order_by(Question.id) \
+        .all()
+    return tuple((question_id, correct_option) for question_id, correct_option in rows)
+
+def build_question_payload(quiz_id):
+    """Serialize the candidate-facing quiz JSON (no correct options), or None if the quiz is missing"""
+    quiz = Quiz.query.options(
+        joinedload(Quiz.chapter).joinedload(Chapter.subject),
+        selectinload(Quiz.questions)
+    ).get(quiz_id)
+
+    if not quiz:
+        return None
+    return current_app.json.dumps({
+        'id': quiz.id,
+        'start_time': quiz.start_time,
+        'end_time': quiz.end_time,
+        'duration': quiz.duration,
+        'chapter': {
+            'id': quiz.chapter.id,
+            'name': quiz.chapter.name,
+            'subject': {
+                'id': quiz.chapter.subject.id,
+                'name': quiz.chapter.subject.name
+            }
+        },
+        'questions': [{
+            'id': q.id,
+            'question_statement': q.question_statement,
+            'option1': q.option1,
+            'option2': q.option2,
+            'option3': q.option3,
+            'option4': q.option4,
+        } for q in quiz.questions]
+    }).encode('utf-8')
+
+def _as_utc_naive(dt):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt
+
+def build_quiz_meta(quiz_id):
+    """Serialize what StartQuiz and SubmitQuiz need to know about a quiz, or None if it is missing"""
+    row = db.session.query(
+        Quiz.id, Quiz.chapter_id, Chapter.subject_id,
+        Quiz.start_time, Quiz.end_time, Quiz.duration
+    ).join(Chapter, Quiz.chapter_id == Chapter.id).filter(Quiz.id == quiz_id).first()
+
+    if not row:
+        return None
+    return json.dumps({
+        'id': row.id,
+        'chapter_id': row.chapter_id,
+        'subject_id': row.subject_id,
+        'start_time': _as_utc_naive(row.start_time).isoformat(),
+        'end_time': _as_utc_naive(row.end_time).isoformat(),
+        'duration': row.duration
+    }).encode('utf-8')
+
+def _decode_answer_key(value):
+    return tuple(tuple(pair) for pair in json.loads(value))
+
+def _decode_quiz_meta(value):
+    meta = json.loads(value)
+    meta['start_time'] = datetime.fromisoformat(meta['start_time'])
+    meta['end_time'] = datetime.fromisoformat(meta['end_time'])
+    return meta
+
+def _cached(local_cache, kind, quiz_id, build, decode=None):
+    """Return a quiz's `kind` from the process LRU, then Redis, then build().
+
+    build returns the serialized bytes stored in Redis (or None if the quiz is
+    missing); the process LRU keeps the decoded value so hits cost no parsing.
+    """
+    decode = decode or (lambda value: value)
+    version = content_version(quiz_id)
+    if version is None:
+        value = build(quiz_id)
+        return decode(value) if value is not None else None
+
+    cache_key = (quiz_id, version)
+    cached = local_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    redis_key = f"quiz:{quiz_id}:{kind}:{version}"
+    try:
+        value = redis_client.get(redis_key)
+    except RedisError:
+        value = None
+
+    if value is None:
+        value = build(quiz_id)
+        if value is None:
+            return None
+        try:
+            redis_client.set(redis_key, value, ex=PAYLOAD_TTL)
+        except RedisError:
+            pass
+
+    cached = decode(value)
+    local_cache.set(cache_key, cached)
+    return cached
+
+def get_question_payload(quiz_id):
+    """Return the serialized candidate-facing question payload, or None if the quiz is missing"""
+    return _cached(_question_payloads, 'questions', quiz_id, build_question_payload)
+
+def get_answer_key(quiz_id):
+    """Return ((question_id, correct_option), ...) for a quiz"""
+    return _cached(
+        _answer_keys, 'answers', quiz_id,
+        lambda quiz_id: json.dumps(load_answer_key(quiz_id)).encode('utf-8'),
+        _decode_answer_key
+    )
+
+def get_quiz_meta(quiz_id):
+    """Return {id, chapter_id, subject_id, start_time, end_time, duration} with naive UTC times"""
+    return _cached(_quiz_meta, 'meta', quiz_id, build_quiz_meta, _decode_quiz_meta)
+
+def warm_quiz(quiz_id):
+    """Load every cached structure for a quiz into Redis ahead of its start_time.
+
+    This is all the per-quiz data a candidate's requests read: StartQuiz needs
+    the quiz meta, the question page the payload and SubmitQuiz the answer key.
+    The rest of StartQuiz is per user (attempt state, the attempt insert), so
+    there is nothing else to warm before the quiz opens.
+    """
+    if get_quiz_meta(quiz_id) is None:
+        return False
+    get_question_payload(quiz_id)
+    get_answer_key(quiz_id)
+    return True
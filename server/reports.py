@@ -0,0 +1,88 @@
+from collections import defaultdict
+from itertools import groupby
+from sqlalchemy import select
+from models import Role, User, QuizAttempt, Quiz, Chapter, Subject
+from grading import results_for_rows, percentage
+from exports import iter_batches
+
+# Monthly reports for every student are built from one streamed query over
+# the month's finished attempts, ordered by user. Rows are grouped by user as
+# they arrive, so the job costs one pass over the month's activity instead of
+# an attempts query per student, and only one student's rows are in memory.
+
+def monthly_attempts_query(start, end):
+    """Finished student attempts submitted in [start, end), grouped by user"""
+    return select(
+        QuizAttempt.user_id, User.full_name, User.email, QuizAttempt.id,
+        QuizAttempt.quiz_id, Subject.name, Chapter.name, QuizAttempt.end_time,
+        QuizAttempt.correct_count, QuizAttempt.total_questions
+    ).select_from(QuizAttempt) \
+        .join(User, QuizAttempt.user_id == User.id) \
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id) \
+        .join(Chapter, Quiz.chapter_id == Chapter.id) \
+        .join(Subject, Chapter.subject_id == Subject.id) \
+        .where(
+            User.role == Role.USER,
+            QuizAttempt.end_time.isnot(None),
+            QuizAttempt.end_time >= start,
+            QuizAttempt.end_time < end
+        ) \
+        .order_by(QuizAttempt.user_id, QuizAttempt.id)
+
+def _graded(batch):
+    return [(*row[:8], correct, total) for row, correct, total in results_for_rows(batch)]
+
+def build_monthly_report(rows):
+    """Return the render_html_report arguments (except month) for one student's attempt rows"""
+    user_id, full_name, email = rows[0][:3]
+    subject_stats = defaultdict(lambda: {'correct': 0, 'total': 0, 'quizzes': set()})
+    total_correct = 0
+    total_questions = 0
+    best_score = 0
+    best_quiz = None
+    quiz_history = []
+
+    for _, _, _, _, quiz_id, subject, chapter, end_time, correct, total in rows:
+        if total:
+            subject_stats[subject]['total'] += total
+            subject_stats[subject]['correct'] += correct
+            subject_stats[subject]['quizzes'].add(quiz_id)
+        total_questions += total
+        total_correct += correct
+
+        attempt_score = (correct / total) * 100 if total else 0
+        quiz_name = f"{subject} - {chapter}"
+        if attempt_score > best_score:
+            best_score = attempt_score
+            best_quiz = quiz_name
+
+        quiz_history.append({
+            'date': end_time.date().isoformat(),
+            'quiz_name': quiz_name,
+            'score': round(attempt_score, 1),
+            'correct': correct,
+            'total': total
+        })
+
+    subject_breakdown = [{
+        'name': subject,
+        'quizzes_taken': len(stats['quizzes']),
+        'accuracy': percentage(stats['correct'], stats['total'], 1),
+        'correct': stats['correct'],
+        'total': stats['total']
+    } for subject, stats in subject_stats.items()]
+
+    return {
+        'user': {'id': user_id, 'full_name': full_name, 'email': email},
+        'quiz_count': len(rows),
+        'avg_score': percentage(total_correct, total_questions, 1),
+        'best_quiz': {'name': best_quiz, 'score': round(best_score, 1)} if best_quiz else None,
+        'subject_breakdown': subject_breakdown,
+        'quiz_history': quiz_history
+    }
+
+def iter_monthly_reports(start, end):
+    """Yield a report for every student with finished attempts in [start, end), in user id order"""
+    rows = (row for batch in iter_batches(monthly_attempts_query(start, end), _graded) for row in batch)
+    for _, user_rows in groupby(rows, key=lambda row: row[0]):
+        yield build_monthly_report(list(user_rows))
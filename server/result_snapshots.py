@@ -0,0 +1,111 @@
+import gzip
+import hashlib
+import json
+from redis import RedisError
+from extensions import redis_client
+from models import db, Score, Question
+from grading import percentage
+from quiz_cache import content_version
+
+# A submitted attempt's results only change when an admin edits the quiz, so
+# the full results document is built once (one joined query) when the attempt
+# is finalized and kept in Redis as a gzip-compressed snapshot. Each snapshot
+# records the quiz content version it was built from; after an edit bumps the
+# version the snapshot no longer matches and is rebuilt on the next read.
+
+SNAPSHOT_TTL = 30 * 24 * 60 * 60
+
+def _snapshot_key(attempt_id):
+    return f"results:attempt:{attempt_id}"
+
+def build_documents(attempts):
+    """Return {attempt_id: results document} for finalized attempts with one joined query"""
+    attempts = list(attempts)
+    if not attempts:
+        return {}
+
+    rows = db.session.query(
+        Score.attempt_id, Score.selected_option,
+        Question.id, Question.question_statement,
+        Question.option1, Question.option2, Question.option3, Question.option4,
+        Question.correct_option
+    ).join(Question, Score.question_id == Question.id).filter(
+        Score.attempt_id.in_([a.id for a in attempts])
+    ).order_by(Score.attempt_id, Score.id).all()
+
+    questions = {a.id: [] for a in attempts}
+    for row in rows:
+        questions[row.attempt_id].append({
+            'question_id': row.id,
+            'statement': row.question_statement,
+            'options': [row.option1, row.option2, row.option3, row.option4],
+            'correct_option': row.correct_option,
+            'selected_option': row.selected_option,
+            'is_correct': row.selected_option == row.correct_option
+        })
+
+    documents = {}
+    for attempt in attempts:
+        results = questions[attempt.id]
+        correct_count = sum(1 for result in results if result['is_correct'])
+        documents[attempt.id] = {
+            'quiz_id': attempt.quiz_id,
+            'attempt_id': attempt.id,
+            'start_time': attempt.start_time.isoformat() + 'Z',
+            'end_time': attempt.end_time.isoformat() + 'Z' if attempt.end_time else None,
+            'time_spent': attempt.time_spent,
+            'total_questions': len(results),
+            'correct_answers': correct_count,
+            'score_percentage': percentage(correct_count, len(results)),
+            'questions': results
+        }
+    return documents
+
+def store_snapshots(attempts):
+    """Build and store snapshots for finalized attempts; returns {attempt_id: snapshot}"""
+    attempts = [a for a in attempts if a.end_time is not None]
+    documents = build_documents(attempts)
+
+    snapshots = {}
+    pipe = redis_client.pipeline()
+    for attempt in attempts:
+        body = gzip.compress(json.dumps(documents[attempt.id]).encode('utf-8'))
+        snapshot = {
+            'user_id': attempt.user_id,
+            'quiz_id': attempt.quiz_id,
+            'version': content_version(attempt.quiz_id),
+            'etag': hashlib.sha1(body).hexdigest(),
+            'body': body
+        }
+        snapshots[attempt.id] = snapshot
+        if snapshot['version'] is not None:
+            pipe.hset(_snapshot_key(attempt.id), mapping=snapshot)
+            pipe.expire(_snapshot_key(attempt.id), SNAPSHOT_TTL)
+
+    try:
+        pipe.execute()
+    except RedisError as e:
+        print(f"Failed to store result snapshots: {str(e)}")
+    return snapshots
+
+def get_snapshot_header(attempt_id):
+    """Return {user_id, quiz_id, etag} for a current snapshot, or None if missing or stale"""
+    try:
+        user_id, quiz_id, version, etag = redis_client.hmget(
+            _snapshot_key(attempt_id), 'user_id', 'quiz_id', 'version', 'etag'
+        )
+    except RedisError:
+        return None
+    if etag is None:
+        return None
+
+    quiz_id = int(quiz_id)
+    if content_version(quiz_id) != int(version):
+        return None
+    return {'user_id': int(user_id), 'quiz_id': quiz_id, 'etag': etag.decode()}
+
+def get_snapshot_body(attempt_id):
+    try:
+        return redis_client.hget(_snapshot_key(attempt_id), 'body')
+    except RedisError:
+        return None
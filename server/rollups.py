@@ -0,0 +1,216 @@
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, case, select, insert as sql_insert
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, DailyQuizStats, QuizAttempt, Quiz, Chapter, User
+
+# Admin statistics are answered from DailyQuizStats, one row per IST day x
+# quiz x user role. Starts count towards the day the attempt started and
+# submissions towards the day it was submitted. StartQuiz, SubmitQuiz and the
+# submission queue add their deltas with an upsert in the same transaction as
+# the attempt write; regrades and deletions are picked up by rebuild_rollups,
+# which recomputes rows from QuizAttempt (nightly for everything, or per quiz
+# in a Celery task after an admin edit). Both hold lock_rollups until they
+# commit, so a rebuild either sees an attempt together with its delta or
+# neither of them, and never counts an attempt twice.
+
+# IST has no daylight saving, so a fixed offset is exact
+IST_OFFSET = timedelta(hours=5, minutes=30)
+REBUILD_BATCH_SIZE = 1000
+# PostgreSQL advisory lock class of the rollups; key 0 covers every quiz
+ROLLUP_LOCK = 7041
+
+COUNTERS = ('attempts', 'completions', 'correct_count', 'total_questions', 'time_spent', 'active_users')
+
+def ist_day(dt):
+    """Return the IST calendar day of a naive UTC datetime"""
+    return (dt + IST_OFFSET).date()
+
+def ist_day_start(day):
+    """Return the naive UTC datetime at which an IST calendar day begins"""
+    return datetime.combine(day, time()) - IST_OFFSET
+
+def ist_date(column):
+    """SQL expression for the IST calendar day of a naive UTC datetime column"""
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.date(column, f"+{int(IST_OFFSET.total_seconds() // 60)} minutes")
+    return func.date(column + IST_OFFSET)
+
+def _as_date(value):
+    # SQLite returns func.date() as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def user_roles(user_ids):
+    """Return {user_id: Role} in one query"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    return dict(db.session.query(User.id, User.role).filter(User.id.in_(user_ids)).all())
+
+def lock_rollups(quiz_ids=None, exclusive=False):
+    """Lock the rollup rows of the given quizzes (all if None) until the transaction ends.
+
+    Deltas take shared locks, rebuilds exclusive ones. Only PostgreSQL needs
+    this: SQLite has a single writer and rebuild_rollups writes before it reads.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    if quiz_ids is None:
+        db.session.execute(select(func.pg_advisory_xact_lock(ROLLUP_LOCK, 0)))
+        return
+    db.session.execute(select(func.pg_advisory_xact_lock_shared(ROLLUP_LOCK, 0)))
+    lock = func.pg_advisory_xact_lock if exclusive else func.pg_advisory_xact_lock_shared
+    # A fixed order keeps concurrent rebuilds of overlapping quizzes from deadlocking
+    for quiz_id in sorted(set(quiz_ids)):
+        db.session.execute(select(lock(ROLLUP_LOCK, quiz_id)))
+
+def _add_to_rollups(deltas):
+    """Add [{day, subject_id, chapter_id, quiz_id, user_role, <counters>}] with one upsert"""
+    if not deltas:
+        return
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        insert = postgresql.insert
+    elif dialect == 'sqlite':
+        insert = sqlite.insert
+    else:
+        raise NotImplementedError(f"Rollup upsert is not supported on {dialect}")
+
+    # Merge deltas for the same row: one statement may not update a row twice
+    rows = {}
+    for delta in deltas:
+        key = (delta['day'], delta['quiz_id'], delta['user_role'])
+        if key not in rows:
+            rows[key] = {**delta, **{counter: 0 for counter in COUNTERS}}
+        for counter in COUNTERS:
+            rows[key][counter] += delta.get(counter, 0)
+
+    lock_rollups({delta['quiz_id'] for delta in deltas})
+    stmt = insert(DailyQuizStats.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'quiz_id', 'user_role'],
+        set_={counter: getattr(DailyQuizStats.__table__.c, counter) + getattr(stmt.excluded, counter)
+              for counter in COUNTERS}
+    )
+    db.session.execute(stmt, list(rows.values()))
+
+def record_attempt_started(user_id, quiz, start_time):
+    """Count a newly created attempt; quiz is the cached quiz meta"""
+    _add_to_rollups([{
+        'day': ist_day(start_time),
+        'subject_id': quiz['subject_id'],
+        'chapter_id': quiz['chapter_id'],
+        'quiz_id': quiz['id'],
+        'user_role': user_roles([user_id])[int(user_id)],
+        'attempts': 1,
+        'active_users': 1
+    }])
+
+def record_attempts_completed(completed):
+    """Count finalized attempts, given [(attempt, quiz meta)], before the session commits"""
+    roles = user_roles(attempt.user_id for attempt, _ in completed)
+    deltas = []
+    for attempt, quiz in completed:
+        day = ist_day(attempt.end_time)
+        deltas.append({
+            'day': day,
+            'subject_id': quiz['subject_id'],
+            'chapter_id': quiz['chapter_id'],
+            'quiz_id': quiz['id'],
+            'user_role': roles[attempt.user_id],
+            'completions': 1,
+            'correct_count': attempt.correct_count or 0,
+            'total_questions': attempt.total_questions or 0,
+            'time_spent': attempt.time_spent or 0,
+            # The user was already counted as active on the day they started
+            'active_users': 1 if ist_day(attempt.start_time) != day else 0
+        })
+    _add_to_rollups(deltas)
+
+def _grouped_attempts(day_column, *columns, criteria=()):
+    day = ist_date(day_column)
+    return db.session.query(
+        day, QuizAttempt.quiz_id, Quiz.chapter_id, Chapter.subject_id, User.role, *columns
+    ).select_from(QuizAttempt) \
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id) \
+        .join(Chapter, Quiz.chapter_id == Chapter.id) \
+        .join(User, QuizAttempt.user_id == User.id) \
+        .filter(*criteria) \
+        .group_by(day, QuizAttempt.quiz_id, Quiz.chapter_id, Chapter.subject_id, User.role) \
+        .all()
+
+def compute_rollups(*criteria):
+    """Recompute rollup rows from QuizAttempt for attempts matching the criteria"""
+    rows = {}
+
+    def row(day, quiz_id, chapter_id, subject_id, role):
+        key = (_as_date(day), quiz_id, role)
+        if key not in rows:
+            rows[key] = {
+                'day': key[0], 'subject_id': subject_id, 'chapter_id': chapter_id,
+                'quiz_id': quiz_id, 'user_role': role, **{counter: 0 for counter in COUNTERS}
+            }
+        return rows[key]
+
+    started = _grouped_attempts(QuizAttempt.start_time, func.count(QuizAttempt.id), criteria=criteria)
+    for *key, attempts in started:
+        entry = row(*key)
+        entry['attempts'] += attempts
+        entry['active_users'] += attempts
+
+    completed = _grouped_attempts(
+        QuizAttempt.end_time,
+        func.count(QuizAttempt.id),
+        func.coalesce(func.sum(QuizAttempt.correct_count), 0),
+        func.coalesce(func.sum(QuizAttempt.total_questions), 0),
+        func.coalesce(func.sum(QuizAttempt.time_spent), 0),
+        func.sum(case((ist_date(QuizAttempt.start_time) != ist_date(QuizAttempt.end_time), 1), else_=0)),
+        criteria=(QuizAttempt.end_time.isnot(None), *criteria)
+    )
+    for *key, completions, correct, total, time_spent, other_day in completed:
+        entry = row(*key)
+        entry['completions'] += completions
+        entry['correct_count'] += int(correct)
+        entry['total_questions'] += int(total)
+        entry['time_spent'] += int(time_spent)
+        entry['active_users'] += int(other_day)
+
+    return list(rows.values())
+
+def rebuild_rollups(quiz_ids=None, batch_size=REBUILD_BATCH_SIZE):
+    """Replace the rollup rows of the given quizzes (all quizzes if None) in one transaction"""
+    if quiz_ids is None:
+        stale = DailyQuizStats.query
+        criteria = ()
+    else:
+        quiz_ids = list(quiz_ids)
+        if not quiz_ids:
+            return 0
+        stale = DailyQuizStats.query.filter(DailyQuizStats.quiz_id.in_(quiz_ids))
+        criteria = (QuizAttempt.quiz_id.in_(quiz_ids),)
+
+    lock_rollups(quiz_ids, exclusive=True)
+    stale.delete(synchronize_session=False)
+    rows = compute_rollups(*criteria)
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(sql_insert(DailyQuizStats), rows[start:start + batch_size])
+    db.session.commit()
+    return len(rows)
+
+def _sum_columns():
+    return (func.coalesce(func.sum(DailyQuizStats.completions), 0),
+            func.coalesce(func.sum(DailyQuizStats.correct_count), 0),
+            func.coalesce(func.sum(DailyQuizStats.total_questions), 0))
+
+def rollup_totals(*criteria):
+    """Return (completions, correct, total) over the rollup rows matching the criteria"""
+    completions, correct, total = db.session.query(*_sum_columns()).filter(*criteria).one()
+    return int(completions), int(correct), int(total)
+
+def rollup_by(group_column, *criteria):
+    """Return {group value: (completions, correct, total)} grouped by a DailyQuizStats column"""
+    rows = db.session.query(group_column, *_sum_columns()) \
+        .filter(*criteria) \
+        .group_by(group_column) \
+        .order_by(group_column) \
+        .all()
+    return {key: (int(completions), int(correct), int(total)) for key, completions, correct, total in rows}
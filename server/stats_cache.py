@@ -0,0 +1,101 @@
+import json
+import math
+import random
+import time
+from functools import wraps
+from flask import request
+from redis import RedisError
+from redis.exceptions import LockError
+from extensions import redis_client
+
+# Admin statistics are expensive aggregates that every open dashboard polls.
+# memoize_stats caches a resource's (body, status) in Redis per query string
+# and keeps the entry around for STALE_TTL past its expiry, so that:
+#   - only the worker holding the refresh lock recomputes (single flight);
+#   - while it does, everyone else is served the stale value;
+#   - refreshes start early with a probability that rises as expiry nears and
+#     with how long the last computation took (XFetch), so a hot entry is
+#     usually refreshed before it ever expires.
+# A cold entry makes the other callers wait up to LOCK_WAIT for the value.
+
+STATS_TTL = 300
+STALE_TTL = 600
+# Scales how early refreshes start; 1.0 is the XFetch default
+EARLY_REFRESH_BETA = 1.0
+LOCK_TIMEOUT = 60
+LOCK_WAIT = 10
+LOCK_POLL_INTERVAL = 0.1
+
+def _entry_key(name, view_args):
+    path = '/'.join(f"{k}={v}" for k, v in sorted(view_args.items()))
+    args = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items()))
+    return f"stats:{name}:{path}:{args}"
+
+def _should_refresh_early(entry, now):
+    # -log(U) is exponentially distributed, so refreshes spread out ahead of expiry
+    return now - entry['delta'] * EARLY_REFRESH_BETA * math.log(1 - random.random()) >= entry['expires_at']
+
+def _release(lock):
+    try:
+        lock.release()
+    except (LockError, RedisError):
+        # Expired mid-computation; the next holder simply recomputes again
+        pass
+
+def _read(key):
+    cached = redis_client.get(key)
+    return json.loads(cached) if cached else None
+
+def _compute_and_store(key, ttl, compute):
+    started = time.time()
+    body, status = compute()
+    finished = time.time()
+    if status == 200:
+        entry = {'body': body, 'delta': finished - started, 'expires_at': finished + ttl}
+        try:
+            redis_client.set(key, json.dumps(entry), ex=ttl + STALE_TTL)
+        except RedisError as e:
+            print(f"Failed to cache {key}: {str(e)}")
+    return body, status
+
+def memoize_stats(name, ttl=STATS_TTL):
+    """Cache a stats resource's GET response with single-flight, early refresh and stale-while-revalidate"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            compute = lambda: f(*args, **kwargs)
+            key = _entry_key(name, kwargs)
+            lock = redis_client.lock(f"{key}:lock", timeout=LOCK_TIMEOUT)
+
+            try:
+                entry = _read(key)
+                now = time.time()
+                if entry and now < entry['expires_at'] and not _should_refresh_early(entry, now):
+                    return entry['body'], 200
+
+                acquired = lock.acquire(blocking=False)
+            except RedisError:
+                return compute()
+
+            if acquired:
+                try:
+                    return _compute_and_store(key, ttl, compute)
+                finally:
+                    _release(lock)
+
+            # Someone else is refreshing: serve what we have, even if stale
+            if entry:
+                return entry['body'], 200
+
+            deadline = time.time() + LOCK_WAIT
+            while time.time() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                try:
+                    entry = _read(key)
+                except RedisError:
+                    break
+                if entry:
+                    return entry['body'], 200
+            return compute()
+        return decorated_function
+    return decorator
@@ -0,0 +1,217 @@
+import json
+import os
+import socket
+from datetime import datetime
+from redis import RedisError, ResponseError
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from extensions import redis_client
+from models import db, QuizAttempt, Score
+from grading import grade_answers, finalize_attempt
+from quiz_cache import get_answer_key, get_quiz_meta
+from attempt_state import set_attempt_states, state_from_attempt, forget_attempt_state
+from result_snapshots import store_snapshots
+from rollups import record_attempts_completed
+
+# Quiz submissions are persisted either inline by SubmitQuiz or, when
+# SUBMIT_QUEUE_ENABLED is set, appended to a Redis stream and written in
+# batches by the drain_submission_stream Celery task. Both paths share
+# apply_submission so an attempt is finalized the same way either way.
+# A batch that fails is retried one message at a time; a message that still
+# fails for anything but an unavailable database goes to DEAD_LETTER_KEY, so
+# one bad payload cannot hold back the submissions queued with it.
+
+STREAM_KEY = 'quiz:submissions'
+DEAD_LETTER_KEY = 'quiz:submissions:dead'
+CONSUMER_GROUP = 'submission-writers'
+DRAIN_BATCH_SIZE = 500
+# Messages left unacknowledged this long (a worker died mid-batch) are reclaimed
+RECLAIM_IDLE_MS = 60000
+PENDING_TTL = 24 * 60 * 60
+
+def score_rows(user_id, quiz_id, attempt_id, answer_key, answers, timestamp):
+    """Build plain Score row dicts for a bulk insert, one per question in the answer key"""
+    return [{
+        'user_id': user_id,
+        'quiz_id': quiz_id,
+        'question_id': question_id,
+        'selected_option': answers.get(str(question_id)),
+        'timestamp': timestamp,
+        'attempt_id': attempt_id
+    } for question_id, _ in answer_key]
+
+def apply_submission(attempt, answer_key, answers, time_spent, submitted_at, scored_at=None):
+    """Finalize the attempt in the session and return the Score rows to insert for it.
+
+    Score rows are stamped with scored_at (submitted_at by default). Queued
+    submissions pass the time they are written, because the settle delay of
+    incremental score exports counts from the Score timestamp.
+    """
+    attempt.end_time = submitted_at
+    attempt.time_spent = time_spent
+    finalize_attempt(attempt, *grade_answers(answer_key, answers))
+    return score_rows(attempt.user_id, attempt.quiz_id, attempt.id, answer_key, answers, scored_at or submitted_at)
+
+def _pending_key(attempt_id):
+    return f"attempt:{attempt_id}:pending"
+
+def is_pending(attempt_id):
+    """True while a queued submission for this attempt has not been written yet"""
+    return bool(redis_client.exists(_pending_key(attempt_id)))
+
+def enqueue_submission(attempt_id, quiz_id, answers, time_spent):
+    """Append a submission to the stream. Returns False if one is already queued."""
+    if not redis_client.set(_pending_key(attempt_id), 1, nx=True, ex=PENDING_TTL):
+        return False
+
+    redis_client.xadd(STREAM_KEY, {'payload': json.dumps({
+        'attempt_id': attempt_id,
+        'quiz_id': quiz_id,
+        'answers': answers,
+        'time_spent': time_spent,
+        'submitted_at': datetime.utcnow().isoformat()
+    })})
+    return True
+
+def _ensure_group():
+    try:
+        redis_client.xgroup_create(STREAM_KEY, CONSUMER_GROUP, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+def _consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def _read_batch(consumer):
+    # Reclaim batches abandoned by a crashed consumer before reading new ones
+    _, messages, *_ = redis_client.xautoclaim(
+        STREAM_KEY, CONSUMER_GROUP, consumer,
+        min_idle_time=RECLAIM_IDLE_MS, count=DRAIN_BATCH_SIZE
+    )
+    if messages:
+        return messages
+
+    response = redis_client.xreadgroup(
+        CONSUMER_GROUP, consumer, {STREAM_KEY: '>'}, count=DRAIN_BATCH_SIZE
+    )
+    return response[0][1] if response else []
+
+def persist_batch(submissions):
+    """Write a batch of queued submissions with one attempt query and one score insert"""
+    attempts = {a.id: a for a in QuizAttempt.query.filter(
+        QuizAttempt.id.in_([s['attempt_id'] for s in submissions])
+    ).all()}
+
+    rows = []
+    completed = []
+    scored_at = datetime.utcnow()
+    for submission in submissions:
+        attempt = attempts.get(submission['attempt_id'])
+        # Skip deleted attempts and redeliveries of a batch that already landed
+        if attempt is None or attempt.end_time is not None:
+            continue
+        rows.extend(apply_submission(
+            attempt,
+            get_answer_key(submission['quiz_id']),
+            submission['answers'],
+            submission['time_spent'],
+            datetime.fromisoformat(submission['submitted_at']),
+            scored_at
+        ))
+        completed.append((attempt, get_quiz_meta(submission['quiz_id'])))
+
+    if rows:
+        db.session.execute(insert(Score), rows)
+    record_attempts_completed(completed)
+    db.session.commit()
+
+    # Write the final state through so status endpoints stop reporting grading_pending
+    states = []
+    for submission in submissions:
+        attempt = attempts.get(submission['attempt_id'])
+        quiz = get_quiz_meta(submission['quiz_id'])
+        if attempt is not None and quiz is not None:
+            states.append((attempt.user_id, state_from_attempt(
+                attempt.id, attempt.quiz_id, quiz['chapter_id'], attempt.start_time, attempt.end_time
+            )))
+    set_attempt_states(states)
+    store_snapshots(attempts.values())
+
+def _acknowledge(message_ids, submissions):
+    pipe = redis_client.pipeline()
+    pipe.xack(STREAM_KEY, CONSUMER_GROUP, *message_ids)
+    pipe.xdel(STREAM_KEY, *message_ids)
+    for submission in submissions:
+        pipe.delete(_pending_key(submission['attempt_id']))
+    pipe.execute()
+
+def _dead_letter(message_id, fields, error):
+    """Park a submission that cannot be written and let the student submit again"""
+    redis_client.xadd(DEAD_LETTER_KEY, {
+        'message_id': message_id,
+        'payload': fields.get(b'payload', b''),
+        'error': str(error)
+    })
+    try:
+        submission = json.loads(fields[b'payload'])
+        attempt = db.session.get(QuizAttempt, submission['attempt_id'])
+    except Exception:
+        return
+    if attempt is not None:
+        # Drop the cached grading_pending state; the next read reloads it from the database
+        forget_attempt_state(attempt.user_id, attempt.quiz_id)
+    redis_client.delete(_pending_key(submission['attempt_id']))
+
+def _persist_messages_one_by_one(messages):
+    """Persist each message on its own after its batch failed; returns how many were written"""
+    written = 0
+    for message_id, fields in messages:
+        if not fields:
+            _acknowledge([message_id], [])
+            continue
+        try:
+            submission = json.loads(fields[b'payload'])
+            persist_batch([submission])
+        except (OperationalError, RedisError):
+            # The database or Redis is down, not the payload: leave the rest for the retry
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            print(f"Dead-lettering queued submission {message_id}: {str(e)}")
+            _dead_letter(message_id, fields, e)
+            _acknowledge([message_id], [])
+            continue
+        _acknowledge([message_id], [submission])
+        written += 1
+    return written
+
+def drain_stream(max_batches=None):
+    """Persist queued submissions batch by batch until the stream is empty"""
+    _ensure_group()
+    consumer = _consumer_name()
+    drained = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        messages = _read_batch(consumer)
+        if not messages:
+            break
+
+        try:
+            submissions = [json.loads(fields[b'payload']) for _, fields in messages if fields]
+            persist_batch(submissions)
+        except (OperationalError, RedisError):
+            # Leave the batch unacknowledged so it is reclaimed and retried
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            print(f"Batch of {len(messages)} queued submissions failed, retrying one by one: {str(e)}")
+            drained += _persist_messages_one_by_one(messages)
+        else:
+            _acknowledge([message_id for message_id, _ in messages], submissions)
+            drained += len(submissions)
+        batches += 1
+    return drained
@@ -0,0 +1,143 @@
+from datetime import date, datetime, time, timedelta
+import pytz
+from redis import RedisError
+from sqlalchemy import func, cast, Date
+from extensions import redis_client
+from models import db
+
+# Day / week / month series for the admin charts. Rows are bucketed by their
+# local calendar day inside SQL, every bucket in the range is returned (empty
+# ones as 0), and buckets that are over are cached in a Redis hash with no
+# expiry, so a request only recomputes the buckets still receiving rows.
+# Weeks start on Monday. Callers that delete history (user, quiz, chapter
+# or subject deletes, the nightly rollup rebuild) call forget_time_series.
+
+TIMEZONE = 'Asia/Kolkata'
+GRANULARITIES = ('day', 'week', 'month')
+# A bucket is cached only once it ended this long ago, so late writes
+# (queued submissions, slow transactions) still land in it
+SETTLE_DELAY = timedelta(hours=1)
+FIRST_FIELD = '_first'
+
+def bucket_of(day, granularity):
+    """Return the first day of the bucket containing day"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def next_bucket(bucket, granularity):
+    if granularity == 'week':
+        return bucket + timedelta(days=7)
+    if granularity == 'month':
+        return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return bucket + timedelta(days=1)
+
+def local_midnight_utc(day, tz=TIMEZONE):
+    """Return the naive UTC datetime at which a local calendar day begins"""
+    localized = pytz.timezone(tz).localize(datetime.combine(day, time()))
+    return localized.astimezone(pytz.utc).replace(tzinfo=None)
+
+def _local_day(dt, tz=TIMEZONE):
+    return pytz.utc.localize(dt).astimezone(pytz.timezone(tz)).date()
+
+def _as_date(value):
+    # SQLite returns dates as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+def bucket_expr(column, granularity, tz=TIMEZONE):
+    """SQL expression for the bucket start of a naive UTC datetime column.
+
+    With tz=None the column already holds local calendar days.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        local = column if tz is None else func.timezone(tz, func.timezone('UTC', column))
+        return cast(func.date_trunc(granularity, local), Date)
+
+    # SQLite has no timezone database, so shift by the zone's current UTC offset
+    modifiers = []
+    if tz is not None:
+        offset = datetime.now(pytz.timezone(tz)).utcoffset()
+        modifiers.append(f"{int(offset.total_seconds() // 60):+d} minutes")
+    if granularity == 'week':
+        modifiers += ['weekday 0', '-6 days']
+    elif granularity == 'month':
+        modifiers.append('start of month')
+    return func.date(column, *modifiers)
+
+def _cache_key(name, granularity):
+    return f"timeseries:{name}:{granularity}"
+
+def forget_time_series(*names):
+    """Drop the cached buckets of the named series after history changed"""
+    try:
+        redis_client.delete(*[_cache_key(name, granularity) for name in names for granularity in GRANULARITIES])
+    except RedisError as e:
+        print(f"Failed to clear cached time series {names}: {str(e)}")
+
+def time_series(name, column, value, granularity='day', since=None, criteria=(), tz=TIMEZONE):
+    """Return [(bucket start, value)] for every bucket from the one containing since to the current one.
+
+    name identifies the series (column, value and criteria) in the cache.
+    value is an aggregate such as func.count(...). With since=None the series
+    starts at the earliest row. tz=None means column holds local days.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+    key = _cache_key(name, granularity)
+    try:
+        cached = {field.decode(): int(count) for field, count in redis_client.hgetall(key).items()}
+        cache_available = True
+    except RedisError:
+        cached = {}
+        cache_available = False
+
+    def bound(day):
+        return day if tz is None else local_midnight_utc(day, tz)
+
+    now = datetime.utcnow()
+    current = bucket_of(_local_day(now, tz or TIMEZONE), granularity)
+    settled = bucket_of(_local_day(now - SETTLE_DELAY, tz or TIMEZONE), granularity)
+
+    if since is not None:
+        first = bucket_of(since, granularity)
+    elif FIRST_FIELD in cached:
+        first = date.fromordinal(cached[FIRST_FIELD])
+    else:
+        earliest = db.session.query(func.min(column)).filter(*criteria).scalar()
+        if earliest is None:
+            return []
+        earliest = _as_date(earliest) if tz is None else _local_day(earliest, tz)
+        first = bucket_of(earliest, granularity)
+
+    buckets = []
+    bucket = first
+    while bucket <= current:
+        buckets.append(bucket)
+        bucket = next_bucket(bucket, granularity)
+
+    # Recompute every bucket that is not settled yet plus any settled one missing from the cache
+    missing = [bucket for bucket in buckets if bucket < settled and bucket.isoformat() not in cached]
+    query_from = missing[0] if missing else max(settled, first)
+    expr = bucket_expr(column, granularity, tz)
+    rows = db.session.query(expr, value) \
+        .filter(column >= bound(query_from), *criteria) \
+        .group_by(expr) \
+        .all()
+    fresh = {_as_date(bucket): int(total or 0) for bucket, total in rows}
+
+    if cache_available and missing:
+        mapping = {bucket.isoformat(): fresh.get(bucket, 0) for bucket in missing}
+        if since is None:
+            mapping[FIRST_FIELD] = first.toordinal()
+        try:
+            redis_client.hset(key, mapping=mapping)
+        except RedisError as e:
+            print(f"Failed to cache time series {name}: {str(e)}")
+
+    return [
+        (bucket, cached[bucket.isoformat()] if bucket.isoformat() in cached and bucket < settled else fresh.get(bucket, 0))
+        for bucket in buckets
+    ]